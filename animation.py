@@ -0,0 +1,34 @@
+from typing import *
+
+
+def linear(t: float):
+    return t
+
+def ease_out_cubic(t: float):
+    return 1 - (1 - t) ** 3
+
+
+"""
+This class interpolates a point between two positions over a duration, following an easing curve.
+It is advanced with the frame timestamps of the main loop, the first timestamp it sees is its start,
+so an animation plays at whatever rate frames are drawn and never skips its beginning.
+"""
+class Tween:
+    def __init__(self, start: Tuple[float, float], end: Tuple[float, float], duration: float, easing: Callable[[float], float] = ease_out_cubic):
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.easing = easing
+        self.start_time = None
+
+    def progress(self, now: float):
+        if self.start_time is None:
+            self.start_time = now
+        if self.duration <= 0:
+            return 1.
+        return min(max((now - self.start_time) / self.duration, 0.), 1.)
+
+    def value(self, now: float):
+        k = self.easing(self.progress(now))
+        return (self.start[0] + (self.end[0] - self.start[0]) * k,
+                self.start[1] + (self.end[1] - self.start[1]) * k)
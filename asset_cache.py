@@ -0,0 +1,90 @@
+import pygame
+import hashlib
+import json
+import mmap
+import os
+import struct
+import io
+
+import config as cfg
+
+
+"""
+On-disk cache of rasterized SVGs.
+All images of a run are packed in a single bundle named after a hash of the SVG sources, the square size and the colors:
+    MAGIC | header length (u32) | JSON header {name: [offset, width, height]} | raw RGBA pixels
+Warm starts memory-map the bundle and build surfaces straight from the pixel buffers, without touching the SVG rasterizer.
+"""
+
+MAGIC = b"MMCA"
+VERSION = 1
+
+
+def bundle_key(svgs: dict):
+    digest = hashlib.sha256()
+    digest.update(f"{VERSION}:{cfg.SQUARE_SIZE}:".encode())
+    digest.update(json.dumps(cfg.colors, sort_keys=True).encode())
+    for name in sorted(svgs):
+        digest.update(name.encode() + b"\0" + svgs[name] + b"\0")
+    return digest.hexdigest()[:32]
+
+
+def bundle_path(key: str):
+    return os.path.join(cfg.ASSET_CACHE_DIR, f"assets-{key}.bin")
+
+
+def write_bundle(path: str, images: dict):
+    header = {}
+    pixels = []
+    offset = 0
+    for name, image in images.items():
+        data = pygame.image.tobytes(image, "RGBA")
+        header[name] = [offset, image.get_width(), image.get_height()]
+        pixels.append(data)
+        offset += len(data)
+    header = json.dumps(header).encode()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for data in pixels:
+            f.write(data)
+    os.replace(tmp_path, path) # Atomic, a crashed write never leaves a broken bundle behind
+
+
+def read_bundle(path: str, convert):
+    # Surfaces are converted while the bundle is mapped, the conversion is what copies the pixels out of it
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an asset bundle")
+        header_len, = struct.unpack_from("<I", mm, len(MAGIC))
+        start = len(MAGIC) + 4 + header_len
+        header = json.loads(mm[len(MAGIC) + 4:start])
+
+        images = {}
+        with memoryview(mm) as view:
+            for name, (offset, width, height) in header.items():
+                with view[start + offset:start + offset + width * height * 4] as pixels:
+                    images[name] = convert(name, pygame.image.frombuffer(pixels, (width, height), "RGBA"))
+        return images
+
+
+def load_svgs(svgs: dict, convert):
+    """
+    Returns {name: convert(name, surface)} for the given {name: svg bytes}, rasterizing only on a cache miss.
+    """
+    path = bundle_path(bundle_key(svgs))
+    if cfg.ASSET_CACHE and os.path.exists(path):
+        try:
+            return read_bundle(path, convert)
+        except (OSError, ValueError, KeyError, struct.error):
+            pass # Corrupted bundle, rasterize again and overwrite it
+
+    raw_images = {name: pygame.image.load(io.BytesIO(svg)) for name, svg in svgs.items()}
+    if cfg.ASSET_CACHE:
+        try:
+            write_bundle(path, raw_images)
+        except OSError:
+            pass # Read-only install, just go without a cache
+    return {name: convert(name, image) for name, image in raw_images.items()}
@@ -0,0 +1,425 @@
+import os
+import argparse
+import json
+import tracemalloc
+from types import SimpleNamespace
+from timeit import default_timer as timer
+
+# Benchmarks run headless, they must not need a display or a sound card
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import chess
+import numpy as np
+
+import config as cfg
+# The font path in the config uses Windows separators, benchmarks usually run on Linux boxes
+cfg.BOARD_TEXT_FONT = cfg.BOARD_TEXT_FONT.replace("\\", os.sep)
+
+import objects
+import hand_features
+import cursor_filter
+import landmark_recording
+
+
+def measure(step, frames):
+    # Returns the per-frame times (ms) and the average bytes allocated by Python code within a frame
+    for i in range(min(frames, 50)): # Warm up
+        step(i)
+
+    times = np.empty(frames)
+    for i in range(frames):
+        start = timer()
+        step(i)
+        times[i] = (timer() - start) * 1000
+
+    # Tracing slows everything down, so allocations get their own pass
+    allocated = 0
+    tracemalloc.start()
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        step(i)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return times, allocated / frames
+
+
+RESULTS = {}
+
+def report(name, times, allocated):
+    RESULTS[name] = dict(
+        fps = float(1000 / times.mean()),
+        p50_ms = float(np.percentile(times, 50)),
+        p99_ms = float(np.percentile(times, 99)),
+        allocated_bytes = float(allocated),
+    )
+    print(f"{name:>24}: {RESULTS[name]['fps']:9.1f} frames/s  p50 {RESULTS[name]['p50_ms']:7.3f} ms  p99 {RESULTS[name]['p99_ms']:7.3f} ms  {allocated:9.1f} B allocated/frame")
+
+
+def cursor_path(i):
+    return objects.Point(100 + int(300 + 250 * np.cos(i / 40)), 100 + int(300 + 250 * np.sin(i / 30)))
+
+def plus_cursor_mask(size=19, bottom=7, top=11):
+    # The former cursor, a plus added to whatever is under it
+    plus_array = np.zeros((size, size), dtype=np.uint8)
+    plus_array[bottom:top+1, :] = 127
+    plus_array[:, bottom:top+1] = 127
+    return plus_array
+
+
+def bench_cursor(frames):
+    # Per-frame cost of compositing the cursor, before (readback + numpy + new surface) and after (Cursor.draw)
+    renderer = objects.Renderer(objects.Point(800, 800))
+    objects.load_consts()
+    screen = renderer.screen
+    cursor = objects.Cursor(renderer)
+
+    board = objects.BOARD_IMAGE
+    scratch = pygame.Surface((cfg.cursor["size"], cfg.cursor["size"]))
+    mask = plus_cursor_mask(cfg.cursor["size"], cfg.cursor["bottom"], cfg.cursor["top"])[:, :, None]
+
+    def legacy(i):
+        pos = cursor_path(i)
+        screen.blit(board, (0, 0), (*pos, cfg.cursor["size"], cfg.cursor["size"]))
+        scratch.blit(screen, (0, 0), (*pos, cfg.cursor["size"], cfg.cursor["size"]))
+        screen.blit(pygame.surfarray.make_surface(mask + pygame.surfarray.array3d(scratch)), pos)
+
+    def current(i):
+        context = objects.RenderContext(screen, cursor_path(i))
+        cursor.update(context)
+        screen.blit(board, (0, 0), (*cursor.abs_pos, cfg.cursor["size"], cfg.cursor["size"]))
+        cursor.draw(context)
+
+    report("cursor (array3d)", *measure(legacy, frames))
+    report("cursor (Cursor.draw)", *measure(current, frames))
+
+
+def build_scene(dirty_rects, backend="software"):
+    # Same scene as chess_main.py
+    renderer = objects.Renderer(objects.Point(800, 800), dirty_rects=dirty_rects, backend=backend)
+    clicker = objects.Clicker(renderer)
+    objects.load_consts()
+    board = objects.Board(renderer, clicker, objects.Point(10, 10))
+    objects.FloatingText(renderer, objects.Point(10, 650), "Press \'R\' to restart", 16, cfg.colors["restart"])
+    objects.FloatingText(renderer, objects.Point(10, 680), "Press \'T\' to takeback", 16, cfg.colors["takeback"])
+    return renderer, clicker, board
+
+
+def square_center(square_code):
+    return objects.Point(10 + chess.square_file(square_code) * cfg.SQUARE_SIZE + cfg.SQUARE_SIZE // 2,
+                         10 + (7 - chess.square_rank(square_code)) * cfg.SQUARE_SIZE + cfg.SQUARE_SIZE // 2)
+
+
+POSITIONS = [
+    chess.STARTING_FEN,
+    "r2qk2r/ppp1bppp/2n1bn2/3pp3/4P3/3P1P2/PPP2KPP/RNB1QBNR w kq - 0 1",
+    "5rk1/pP2pp2/3p2p1/2pPb2p/2Q1N1q1/1R2P3/3B1PPP/6K1 w - - 0 1",
+    "2r5/1P6/8/5pk1/1KP1q1p1/1Q6/8/8 w - - 0 1",
+]
+
+def idle_scenario(renderer, clicker, board):
+    cursor_pos = square_center(chess.E4)
+    def step(i):
+        clicker.highlight(cursor_pos)
+        renderer.step(cursor_pos)
+    return step
+
+def hover_scenario(renderer, clicker, board):
+    def step(i):
+        cursor_pos = cursor_path(i)
+        clicker.highlight(cursor_pos)
+        renderer.step(cursor_pos)
+    return step
+
+def drag_scenario(renderer, clicker, board):
+    # Pick up a piece, carry it around, drop it back, repeat
+    def step(i):
+        if i % 120 == 0:
+            cursor_pos = square_center(chess.G1)
+            clicker.highlight(cursor_pos)
+            clicker.execute_click()
+        elif i % 120 == 119:
+            cursor_pos = square_center(chess.G1)
+            clicker.highlight(cursor_pos)
+            clicker.execute_click(False)
+            board.deselect_square()
+        else:
+            cursor_pos = cursor_path(i)
+            clicker.highlight(cursor_pos)
+        renderer.step(cursor_pos)
+    return step
+
+def positions_scenario(renderer, clicker, board):
+    # New position every few frames, with a selected piece showing its moves
+    def step(i):
+        if i % 10 == 0:
+            board.board.set_fen(POSITIONS[i // 10 % len(POSITIONS)])
+            board.move_index.invalidate()
+            board.deselect_square()
+            board.update_board()
+            board.select_square(next(iter(board.board.legal_moves)).from_square)
+        cursor_pos = cursor_path(i)
+        clicker.highlight(cursor_pos)
+        renderer.step(cursor_pos)
+    return step
+
+def moves_scenario(renderer, clicker, board):
+    # A move played by clicks every 30 frames, pieces glide at a simulated 60 frames/s
+    cursor_pos = square_center(chess.E4)
+    def step(i):
+        if i % 30 == 0:
+            if board.board.is_game_over():
+                board.reset()
+            move = next(iter(board.board.legal_moves))
+            board.square_clicked(move.from_square, board.board.turn)
+            board.square_clicked(move.to_square, board.board.turn, move.promotion)
+        clicker.highlight(cursor_pos)
+        renderer.step(cursor_pos, i / cfg.TARGET_FPS)
+    return step
+
+SCENARIOS = dict(
+    idle = idle_scenario,
+    hover = hover_scenario,
+    drag = drag_scenario,
+    positions = positions_scenario,
+    moves = moves_scenario,
+)
+
+MODES = dict(
+    full = dict(dirty_rects=False),
+    dirty = dict(dirty_rects=True),
+    texture = dict(dirty_rects=False, backend="texture"),
+)
+
+def bench_render(frames):
+    # Whole frames through Renderer.step and Clicker.highlight, full repaint vs dirty rects vs textures
+    for name, scenario in SCENARIOS.items():
+        for mode, options in MODES.items():
+            renderer, clicker, board = build_scene(**options)
+            report(f"{name} ({mode})", *measure(scenario(renderer, clicker, board), frames))
+
+
+def bench_text(frames):
+    # A clock label set every frame, its text changes once per second: Font.render every time vs the text cache
+    renderer = objects.Renderer(objects.Point(800, 800))
+    font = pygame.font.Font(cfg.BOARD_TEXT_FONT, 16)
+    clock = objects.FloatingText(renderer, objects.Point(10, 710), "", 16, cfg.colors["boardtext"])
+
+    def clock_text(i):
+        seconds = i // cfg.TARGET_FPS
+        return f"White {seconds // 60:02d}:{seconds % 60:02d}"
+
+    def legacy(i):
+        clock.surface = font.render(clock_text(i), cfg.TEXT_ANTIALIAS, cfg.colors["boardtext"], cfg.colors["background"])
+
+    def current(i):
+        clock.set_text(clock_text(i))
+
+    report("text (Font.render)", *measure(legacy, frames))
+    report("text (cached)", *measure(current, frames))
+
+
+def fake_result(landmarks, is_right):
+    # Same shape as a MediaPipe HandLandmarkerResult with one hand
+    return SimpleNamespace(
+        hand_landmarks = [[SimpleNamespace(x=x, y=y, z=z) for x, y, z in landmarks]],
+        handedness = [[SimpleNamespace(category_name="Right" if is_right else "Left")]],
+    )
+
+def bench_hands(frames):
+    # Gesture thread cost of a landmark result: the former per-landmark Hand construction vs the feature kernel,
+    # plus the scaled positions process_gestures asks for
+    rng = np.random.default_rng(0)
+    results = [fake_result(rng.random((21, 3)), i % 2 == 0) for i in range(64)]
+    scales = np.array([[.25, .25], [.75, .75]])
+
+    def legacy(i):
+        result = results[i % len(results)]
+        abs_hand = np.array([(landmark.x, landmark.y, landmark.z) for landmark in result.hand_landmarks[0]])
+        palm = abs_hand[0] * .5 + abs_hand[5] * .125 + abs_hand[9] * .125 + abs_hand[13] * .125 + abs_hand[17] * .125
+        palm_width = np.linalg.norm(abs_hand[5] - abs_hand[17])
+        rel_hand = (abs_hand - palm) / palm_width
+        wrist, index_base, middle_base, pinky_base = rel_hand[0], rel_hand[5], rel_hand[9], rel_hand[17]
+        palm_normal = np.cross(index_base - wrist, pinky_base - wrist)
+        palm_normal = palm_normal / np.linalg.norm(palm_normal)
+        if result.handedness[0][0].category_name == 'Left':
+            palm_normal = -palm_normal
+        pinky_normal = np.cross(palm_normal, middle_base - wrist)
+        pinky_normal = pinky_normal / np.linalg.norm(pinky_normal)
+        fingers_normal = np.cross(pinky_normal, palm_normal)
+        fingers_normal = fingers_normal / np.linalg.norm(fingers_normal)
+        if result.handedness[0][0].category_name == 'Left':
+            pinky_normal = -pinky_normal
+        norm_hand = rel_hand @ np.array([pinky_normal, fingers_normal, palm_normal]).T
+        thumb_vec = norm_hand[4] / np.linalg.norm(norm_hand[4])
+        index_vec = norm_hand[8] / np.linalg.norm(norm_hand[8])
+        hand_features.is_clicking(np.dot(thumb_vec, index_vec), np.linalg.norm(thumb_vec - index_vec))
+        for _ in range(6):
+            np.clip((palm[:2] - scales[0]) / (scales[1] - scales[0]), 0, 1)
+
+    def current(i):
+        hand = hand_features.Hand.from_landmarks(*hand_features.landmarks_of(results[i % len(results)]), i)
+        for _ in range(6):
+            hand.scaled(scales)
+
+    report("hand (per landmark)", *measure(legacy, frames))
+    report("hand (feature kernel)", *measure(current, frames))
+
+    # Whole recordings go through the kernel at once
+    batch = rng.random((frames, 21, 3))
+    is_right = np.ones(frames, dtype=bool)
+    kernel = hand_features.FeatureKernel(frames)
+    start = timer()
+    kernel(batch, is_right)
+    print(f"{'hand (batch of ' + str(frames) + ')':>24}: {(timer() - start) * 1e6 / frames:9.2f} us/hand")
+
+
+def hand_trajectory(t):
+    # Ground truth cursor position (screen units) at t (ms): still, slow circles, still, fast back and forth swipes
+    t = t % 8000
+    center = np.array([.5, .5])
+    if t < 1000 or 4000 <= t < 5000:
+        return center
+    if t < 4000:
+        phase = (t - 1000) / 3000 * 2 * np.pi
+        return center + .2 * np.array([np.sin(phase), 1 - np.cos(phase)]) * [1, .5]
+    return center + np.array([.3 * np.sin((t - 5000) / 3000 * 6 * np.pi), 0])
+
+def simulate_hands(duration_ms, rng, frame_ms=1000 / 30, inference_ms=35, noise=.003):
+    # (timestamp, time received, position) of every hand the detector would get: the camera delivers a frame every
+    # frame_ms, the next frame is only submitted once the previous inference is done
+    hands = []
+    grab = 0.
+    while grab < duration_ms:
+        seen = grab - cfg.CAMERA_LATENCY_MS
+        received = grab + inference_ms * rng.uniform(.7, 1.3)
+        hands.append((grab, received, hand_trajectory(seen) + rng.normal(0, noise, 2)))
+        grab = np.ceil(received / frame_ms) * frame_ms
+    return hands
+
+def track(cursor, hands, frame_ms=1000 / cfg.TARGET_FPS, duration_ms=None):
+    # Cursor positions at every frame, fed the way HandDetector does: each hand when it is received, dated when it was seen
+    duration_ms = duration_ms or hands[-1][1]
+    frame_times = np.arange(hands[0][1], duration_ms, frame_ms)
+    positions = np.empty((len(frame_times), 2))
+    i = 0
+    cursor.reset(hands[0][2], hands[0][0] - cfg.CAMERA_LATENCY_MS)
+    for n, t in enumerate(frame_times):
+        while i + 1 < len(hands) and hands[i + 1][1] <= t:
+            i += 1
+            cursor.update(hands[i][2], hands[i][0] - cfg.CAMERA_LATENCY_MS)
+        positions[n] = np.clip(cursor.predict(t), 0, 1)
+    return frame_times, positions
+
+def tracking_quality(frame_times, positions, truth, pixels=800):
+    # Error to the true position, lag (delay that best explains the error while moving) and jitter (movement while held still)
+    true_positions = np.array([truth(t) for t in frame_times])
+    moving = np.linalg.norm(np.diff(true_positions, axis=0), axis=1) > 1e-9
+    error = np.linalg.norm(positions - true_positions, axis=1)
+
+    lags = np.arange(0, 301, 5)
+    lag_errors = [np.mean(np.linalg.norm(positions - np.array([truth(t - lag) for t in frame_times]), axis=1)[1:][moving]) for lag in lags]
+
+    # Jitter only counts frames where the hand has been still (under a pixel) for a while, not the cursor settling after a move
+    settled = np.array([np.linalg.norm(truth(t) - truth(t - 300)) * pixels < 1 for t in frame_times[1:]]) & ~moving
+    steps = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+    return dict(
+        rms_error_px = float(np.sqrt(np.mean(error ** 2)) * pixels),
+        lag_ms = float(lags[np.argmin(lag_errors)]),
+        jitter_px = float(np.sqrt(np.mean(steps[settled] ** 2)) * pixels) if settled.any() else None,
+    )
+
+def recorded_hands(records, scales=np.array([[.25, .25], [.75, .75]])):
+    # (timestamp, time received, position) of the hands of a recording. Each hand is taken as received when the next
+    # frame was grabbed, the latest it can be since a frame is only submitted once the previous result is in
+    timestamps = records["timestamp_ms"].astype(np.float64)
+    features = hand_features.FeatureKernel(len(records))(records["landmarks"], records["is_right"])
+    positions = hand_features.scaled_positions(features["origin"], scales)
+    received = np.append(timestamps[1:], timestamps[-1] + np.median(np.diff(timestamps)))
+    return list(zip(timestamps, received, positions))
+
+def recorded_trajectory(hands, window_ms=100):
+    # Reference cursor positions of a recording: the hand positions averaged over a window centered on the time they
+    # were seen, smooth and without lag
+    seen = np.array([hand[0] for hand in hands]) - cfg.CAMERA_LATENCY_MS
+    positions = np.array([hand[2] for hand in hands])
+    first = np.searchsorted(seen, seen - window_ms / 2, side="left")
+    last = np.searchsorted(seen, seen + window_ms / 2, side="right")
+    sums = np.concatenate([np.zeros((1, 2)), np.cumsum(positions, axis=0)])
+    smoothed = (sums[last] - sums[first]) / (last - first)[:, None]
+    return lambda t: np.array([np.interp(t, seen, smoothed[:, 0]), np.interp(t, seen, smoothed[:, 1])])
+
+def replay_gestures(records, frame_ms=1000 / cfg.TARGET_FPS):
+    # Clicks and releases of a recording, replayed through HandDetector frame by frame at the recorded pace
+    import gesture_code
+
+    detector = gesture_code.HandDetector(replay_source=records)
+    times = landmark_recording.replay_times(records, 0)
+    i = 0
+    clicks = releases = tracked = 0
+    frame_times = np.arange(times[0], times[-1] + frame_ms, frame_ms)
+    for t in frame_times:
+        while i < len(records) and times[i] <= t:
+            detector.add_hand(records[i]["landmarks"], bool(records[i]["is_right"]), int(times[i]))
+            i += 1
+        cursor_pos, click, release, _ = detector.process_gestures(int(t))
+        clicks += click
+        releases += release
+        tracked += cursor_pos is not None
+    return dict(clicks = clicks, releases = releases, tracked = tracked / len(frame_times))
+
+RECORDING = None
+
+def bench_filters(frames):
+    # Cursor filters on simulated hand tracking, or on a landmark recording, frames at 60 frames/s
+    if RECORDING:
+        records = landmark_recording.load(RECORDING)
+        hands = recorded_hands(records)
+        truth = recorded_trajectory(hands)
+        duration_ms = hands[-1][1]
+    else:
+        duration_ms = max(frames * 1000 / cfg.TARGET_FPS, 8000)
+        hands = simulate_hands(duration_ms, np.random.default_rng(0))
+        truth = hand_trajectory
+
+    for name in cursor_filter.FILTERS:
+        frame_times, positions = track(cursor_filter.create_filter(name), hands, duration_ms=duration_ms)
+        RESULTS[f"filter {name}"] = quality = tracking_quality(frame_times, positions, truth)
+        jitter = "n/a" if quality["jitter_px"] is None else f"{quality['jitter_px']:5.2f}"
+        print(f"{'filter ' + name:>24}: rms error {quality['rms_error_px']:6.1f} px  lag {quality['lag_ms']:5.0f} ms  jitter {jitter} px/frame")
+
+    if RECORDING:
+        RESULTS["gestures"] = gestures = replay_gestures(records)
+        print(f"{'gestures':>24}: {gestures['clicks']} clicks  {gestures['releases']} releases  hand tracked {gestures['tracked']:.0%} of frames")
+
+
+BENCHMARKS = dict(
+    cursor = bench_cursor,
+    render = bench_render,
+    text = bench_text,
+    hands = bench_hands,
+    filters = bench_filters,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless rendering benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"Any of {', '.join(BENCHMARKS)}, all of them by default")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--output", help="Save the results as JSON, to be used as a baseline")
+    parser.add_argument("--recording", help="Landmark recording the filters benchmark replays instead of simulated hands")
+    args = parser.parse_args()
+    RECORDING = args.recording
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    pygame.init()
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args.frames)
+    pygame.quit()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(RESULTS, f, indent=4)
@@ -0,0 +1,106 @@
+import cv2 as cv
+import numpy as np
+
+import config as cfg
+
+
+def contiguous_view(buffer: np.ndarray, shape):
+    # A C contiguous array of this shape over the start of buffer, for frames smaller than the one it was made for
+    return buffer.reshape(-1)[:int(np.prod(shape))].reshape(shape)
+
+
+"""
+Camera capture that only does work on the frames it is asked for.
+grab keeps up with the camera without decoding, retrieve decodes the last grabbed frame and converts it to RGB
+(mirrored if h_flip) into buffers reused across frames, or straight into the caller's buffer.
+Given a region (pixel bounds in the RGB frame, see palm_region) only that part of the frame is converted.
+"""
+class Capture:
+    def __init__(self, camera=0, h_flip=False):
+        self.cam = cv.VideoCapture(camera)
+        self.h_flip = h_flip
+
+        self.frame = None
+        self.rgb_frame = None
+        self.flipped_frame = None
+
+    def is_opened(self):
+        return self.cam.isOpened()
+
+    def grab(self):
+        return self.cam.grab()
+
+    def retrieve(self, out: np.ndarray = None, region=None):
+        retrieved, frame = self.cam.retrieve(self.frame)
+        if not retrieved:
+            return None
+        if frame is not self.frame or self.rgb_frame is None:
+            # First frame or new resolution
+            self.frame = frame
+            self.rgb_frame = np.empty_like(frame)
+            self.flipped_frame = np.empty_like(frame)
+
+        source, rgb_frame, flipped_frame = self.frame, self.rgb_frame, self.flipped_frame
+        if region is not None:
+            x0, y0, x1, y1 = region
+            if self.h_flip:
+                x0, x1 = frame.shape[1] - x1, frame.shape[1] - x0
+            source = self.frame[y0:y1, x0:x1]
+            rgb_frame = contiguous_view(self.rgb_frame, source.shape)
+            flipped_frame = contiguous_view(self.flipped_frame, source.shape)
+        if out is not None and out.shape != source.shape:
+            return None
+
+        if not self.h_flip:
+            return cv.cvtColor(source, cv.COLOR_BGR2RGB, dst=rgb_frame if out is None else out)
+        cv.cvtColor(source, cv.COLOR_BGR2RGB, dst=rgb_frame)
+        return cv.flip(rgb_frame, 1, dst=flipped_frame if out is None else out)
+
+    def frame_shape(self):
+        # Shape of the RGB frames, grabs a first frame if none was retrieved yet
+        if self.frame is None and self.grab():
+            self.retrieve()
+        return None if self.frame is None else self.frame.shape
+
+    def release(self):
+        self.cam.release()
+
+
+def downscaled(frame: np.ndarray, scale: float, buffers: dict):
+    # The frame resized by scale into a buffer reused per frame shape and scale, the frame itself at scale 1
+    if scale == 1:
+        return frame
+    key = (frame.shape, scale)
+    if key not in buffers:
+        height, width = frame.shape[:2]
+        buffers[key] = np.empty((max(int(height * scale), 1), max(int(width * scale), 1)) + frame.shape[2:], frame.dtype)
+    out = buffers[key]
+    return cv.resize(frame, (out.shape[1], out.shape[0]), dst=out, interpolation=cv.INTER_AREA)
+
+
+def palm_region(hand, frame_shape):
+    # Pixel bounds (x0, y0, x1, y1) of a square ROI_PADDING palm widths around the palm of a hand, clamped to the frame,
+    # None (the whole frame) without a hand or when the square would cover most of the frame anyway
+    if hand is None:
+        return None
+    height, width = frame_shape[:2]
+    # Landmark x and depth are in frame widths, y in frame heights
+    half = max(hand.palm_width * width * cfg.ROI_PADDING, cfg.ROI_MIN_SIZE / 2)
+    x, y = hand.origin[0] * width, hand.origin[1] * height
+    x0, x1 = int(max(x - half, 0)), int(min(x + half, width))
+    y0, y1 = int(max(y - half, 0)), int(min(y + half, height))
+    if x1 - x0 < 2 or y1 - y0 < 2 or (x1 - x0) * (y1 - y0) > cfg.ROI_MAX_AREA * width * height:
+        return None
+    return x0, y0, x1, y1
+
+
+def to_frame(landmarks: np.ndarray, region, frame_shape):
+    # Landmarks found in a region, normalized to it, mapped back to the whole frame (in place)
+    if region is None:
+        return landmarks
+    height, width = frame_shape[:2]
+    x0, y0, x1, y1 = region
+    landmarks[:, 0] = (x0 + landmarks[:, 0] * (x1 - x0)) / width
+    landmarks[:, 1] = (y0 + landmarks[:, 1] * (y1 - y0)) / height
+    landmarks[:, 2] *= (x1 - x0) / width
+    return landmarks
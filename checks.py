@@ -0,0 +1,117 @@
+import argparse
+import sys
+
+import chess
+import numpy as np
+import pygame
+
+# Importing the benchmarks sets up a headless pygame and the simulated hands the checks reuse
+import benchmark
+import config as cfg
+import cursor_filter
+
+
+# A filter may overshoot a step of the hand by at most this fraction of the step
+MAX_STEP_OVERSHOOT = .1
+
+
+def check(name, ok, detail):
+    print(f"{'PASS' if ok else 'FAIL'} {name:>40}: {detail}")
+    return ok
+
+def steady_hands(position, duration_ms, frame_ms=1000 / 30, inference_ms=40):
+    # Hands as simulate_hands delivers them, for a hand at position(t) when seen at t, without noise
+    return [(grab, grab + inference_ms, position(grab - cfg.CAMERA_LATENCY_MS)) for grab in np.arange(0, duration_ms, frame_ms)]
+
+def check_filters():
+    ok = True
+    start, end = np.array([.3, .5]), np.array([.7, .4])
+    for name in cursor_filter.FILTERS:
+        # A hand that stays still after the cursor started elsewhere, the cursor settles on it and stops
+        hands = steady_hands(lambda t: start if t < 0 else end, 3000)
+        frame_times, positions = benchmark.track(cursor_filter.create_filter(name), hands)
+        error = np.abs(positions[-1] - end).max()
+        last_moves = np.abs(np.diff(positions[frame_times >= frame_times[-1] - 500], axis=0)).max()
+        ok &= check(f"{name} still hand converges", error <= .01 and last_moves < 1e-6,
+            f"final error {error:.4f}, largest move over the last 0.5 s {last_moves:.2e}")
+
+        # A noisy still hand keeps the cursor around it
+        rng = np.random.default_rng(0)
+        noisy = [(grab, received, pos + rng.normal(0, .003, 2)) for grab, received, pos in hands]
+        frame_times, positions = benchmark.track(cursor_filter.create_filter(name), noisy)
+        error = np.abs(positions[frame_times >= 2000] - end).max()
+        ok &= check(f"{name} noisy still hand", error <= .02, f"largest error after 2 s {error:.4f}")
+
+        # A hand jumping from start to end, extrapolation must not carry the cursor far past it
+        hands = steady_hands(lambda t: start if t < 1000 else end, 3000)
+        _, positions = benchmark.track(cursor_filter.create_filter(name), hands)
+        step = end - start
+        overshoot = ((positions - end) @ step / (step @ step)).max()
+        ok &= check(f"{name} step overshoot", overshoot <= MAX_STEP_OVERSHOOT,
+            f"{overshoot * 100:.1f}% of the step (at most {MAX_STEP_OVERSHOOT * 100:.0f}%)")
+    return ok
+
+
+def random_move(board, rng):
+    # A random legal move, castling, en passant and promotion are played whenever they are legal
+    moves = list(board.legal_moves)
+    special = [move for move in moves if board.is_castling(move) or board.is_en_passant(move) or move.promotion]
+    return (special or moves)[rng.integers(len(special or moves))]
+
+def check_board(games=200, max_plies=150):
+    # Random games played by clicks with random takebacks: the change list of every move or takeback must hold the
+    # squares whose piece changed, and the squares updated incrementally must show what a refresh of every square shows
+    _, _, board = benchmark.build_scene(dirty_rects=True)
+    rng = np.random.default_rng(0)
+    played = dict(moves=0, castlings=0, en_passants=0, promotions=0, takebacks=0)
+    for _ in range(games):
+        # Moves post game events nobody handles here
+        pygame.event.clear()
+        board.reset()
+        for _ in range(max_plies):
+            if board.board.is_game_over():
+                break
+            before = list(board.view.piece_codes)
+            if board.board.move_stack and rng.random() < .1:
+                board.takeback()
+                played["takebacks"] += 1
+            else:
+                move = random_move(board.board, rng)
+                played["castlings"] += board.board.is_castling(move)
+                played["en_passants"] += board.board.is_en_passant(move)
+                played["promotions"] += move.promotion is not None
+                played["moves"] += 1
+                board.square_clicked(move.from_square, board.board.turn)
+                board.square_clicked(move.to_square, board.board.turn, move.promotion)
+
+            # The change list holds exactly the squares whose piece changed
+            changed = [(square_code, piece_code) for square_code, piece_code in enumerate(board.view.piece_codes) if piece_code != before[square_code]]
+            if sorted(board.piece_changes) != changed:
+                return check("board change list", False, f"{board.piece_changes} instead of {changed} after {board.board.fen()}")
+
+            # and a refresh of every square finds nothing left to change
+            if changes := board.update_board():
+                wrong = [chess.square_name(square_code) for square_code, _ in changes]
+                return check("board incremental updates", False, f"{', '.join(wrong)} wrong after {board.board.fen()}")
+    return check("board incremental updates", all(played.values()), ", ".join(f"{count} {name}" for name, count in played.items()))
+
+
+CHECKS = dict(
+    filters = check_filters,
+    board = check_board,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless behaviour checks, exits with an error if any fails")
+    parser.add_argument("checks", nargs="*", help=f"Any of {', '.join(CHECKS)}, all of them by default")
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error(f"unknown check {name}")
+
+    pygame.init()
+    ok = True
+    for name in args.checks or CHECKS:
+        ok &= CHECKS[name]()
+    pygame.quit()
+    sys.exit(0 if ok else 1)
@@ -11,12 +11,29 @@ colors = dict(
     promotion_highlight = "#7ff461",
     restart = "#4DE094",
     takeback = "#4DE0DB",
+    cursor = "#f8f8f8",
+    cursor_outline = "#1d212b",
 )
 
 SQUARES_ALPHA = 128
 SQUARE_SIZE = 70
 
+# Redraw only the regions that changed since the last frame
+DIRTY_RECTS = True
+
+# "software" blits onto the display surface, "texture" uploads images once and draws them through the SDL2 renderer
+# (falls back to software when it is not available)
+RENDER_BACKEND = "software"
+# Window size the texture backend scales the scene to, None for no scaling
+WINDOW_SIZE = None
+
+# Rasterized pieces, board and promotion bubble are cached on disk between runs
+ASSET_CACHE = True
+ASSET_CACHE_DIR = "./cache"
+
 TEXT_ANTIALIAS = True
+# Rendered strings kept around, text that does not change is never rasterized again
+TEXT_CACHE_SIZE = 256
 
 BOARD_TEXT_SIZE = 20
 BOARD_TEXT_H_DISTANCE = 10
@@ -28,7 +45,8 @@ cursor = dict(
     offset = 9,
     size = 19,
     bottom = 7,
-    top = 11
+    top = 11,
+    outline = 1,
 )
 
 MOVE_VOLUME = .6
@@ -36,19 +54,96 @@ ILLEGAL_MOVE_VOLUME = .15
 KING_CHECK_VOLUME = .5
 
 
+TARGET_FPS = 60
+IDLE_AFTER_MS = 1000
+IDLE_TIMEOUT_MS = 500
+# While idle the event queue is checked this often, events are left in it for the main loop to get in order
+IDLE_POLL_MS = 10
+FRAME_STATS_WINDOW = 600
+# Print the frame, engine and gesture stats on exit, they are saved with the recording either way
+PRINT_STATS = False
+
+
 AI_THINK_TIME = 0.1
+AI_PONDER = True
 AI_MOVING_TIME = 1000
 
+# Pieces glide to their square when a move is played by clicks, voice or the AI (not when dropped by hand), 0 to disable
+MOVE_ANIMATION_MS = 150
+
+CLICKER_CELL_SIZE = 70
+
 CURSOR_ORDER = 999
 CURSOR_SHADOW_ORDER = -999
 BOARD_ORDER = 0
 GUISQUARE_ORDER = 1
+PIECE_SPRITE_ORDER = 1.5
 PROMOTION_BUBBLE_ORDER = 2
 PROMOTION_SQUARE_ORDER = 3
 
 
 VOCAL_COMMANDS_TIMOUT = 500
 
+# Check every incremental board update against a full rebuild (slow, for debugging)
+VERIFY_BOARD_UPDATES = False
+
+# Move indices of the last positions seen, kept around for takebacks
+MOVE_INDEX_CACHE_SIZE = 64
+
+
+# Run camera capture and hand landmarking in processes of their own, frames go through a shared memory ring
+GESTURE_PROCESS = False
+FRAME_RING_SLOTS = 3
+
+# Once no hand was seen for end_tracking_ms, landmarking drops to probing this many frames/s at this resolution scale
+IDLE_PROBE_FPS = 4
+IDLE_PROBE_SCALE = .5
+
+# Keyframe tracking: only every KEYFRAME_INTERVAL-th frame is landmarked, the hand is followed with optical flow in between.
+# Flow is trusted while FLOW_MIN_TRACKED of the landmarks track back to where they started, within FLOW_MAX_ERROR palm widths
+KEYFRAME_TRACKING = False
+KEYFRAME_INTERVAL = 3
+FLOW_MIN_TRACKED = .8
+FLOW_MAX_ERROR = .1
+
+# Region of interest: while a hand is tracked, only a square ROI_PADDING palm widths (each side) around its palm is
+# converted and landmarked, whole frames again as soon as the hand is lost
+ROI_CROP = False
+ROI_PADDING = 3.
+ROI_MIN_SIZE = 128 # px
+# Whole frames past this share of the frame, the crop would not save much
+ROI_MAX_AREA = .6
+
+# Cursor motion from hand positions: "interpolate" (fixed speed, the former behaviour), "one_euro" or "kalman",
+# the last two follow the hand as it was last seen and may extrapolate it towards the time the frame is drawn
+CURSOR_FILTER = "one_euro"
+# Time between the camera seeing the hand and the frame being grabbed, hands are timestamped at grab time.
+# An estimate for a typical webcam, it is not measured
+CAMERA_LATENCY_MS = 30
+# Both filters are tuned with `checks.py filters` to overshoot a step by at most 10% of it. one_euro, the default, is
+# also no more jittery than "interpolate" on a still hand (`benchmark.py filters`), no kalman setting that keeps the
+# overshoot bound is (2.4 against 1.2 px/frame), so kalman stays opt-in.
+# Predictions run from the time the hand was seen towards the time the frame is drawn, but at most max_prediction_ms:
+# the rest of the camera and landmarking delay (inference_delay_ms_p50 in the gesture stats) stays as lag,
+# extrapolating further overshoots more when the hand stops
+ONE_EURO = dict(
+    min_cutoff = .2,
+    beta = 10.,
+    d_cutoff = 2.,
+    max_prediction_ms = 15,
+)
+KALMAN = dict(
+    process_noise = 10.,
+    measurement_noise = .01,
+    # Its velocity is too noisy to extrapolate within the overshoot bound, it only smooths
+    max_prediction_ms = 0,
+)
+
+# Landmark streams: record the hands seen to a file, or replay a recording instead of using the camera
+# (headless, no MediaPipe needed), LANDMARK_REPLAY_SPEED > 1 replays faster than recorded
+LANDMARK_RECORDING = None
+LANDMARK_REPLAY = None
+LANDMARK_REPLAY_SPEED = 1.
 
 MIN_PALM_WIDTH_DIFFERENCE = .1
 MAX_HAND_MOVEMENT = 10
@@ -0,0 +1,157 @@
+import numpy as np
+
+import config as cfg
+
+
+"""
+Base class of the filters turning hand positions into cursor positions.
+Positions are in [0, 1] screen units, times in ms. Observations are timestamped when the camera saw the hand,
+predictions are asked for the time the frame is drawn, so a filter can make up for part of the camera and inference delay.
+"""
+class CursorFilter:
+    def reset(self, pos: np.ndarray, t: float):
+        pass
+
+    def update(self, pos: np.ndarray, t: float):
+        pass
+
+    def predict(self, t: float):
+        raise NotImplementedError
+
+
+"""
+The former cursor motion: moves toward the hand at a fixed speed, curving through the previous hand position
+(quadratic interpolation) until the cursor got close to it. Does not extrapolate.
+"""
+class InterpolationFilter(CursorFilter):
+    def __init__(self, cursor_speed: float = .5, min_cursor_movement: float = .01):
+        self.cursor_speed = cursor_speed
+        self.min_cursor_movement = min_cursor_movement
+
+    def reset(self, pos: np.ndarray, t: float):
+        self.cursor_pos = pos.copy()
+        self.prev_pos = None
+        self.curr_pos = pos
+        self.last_predict = None
+
+    def update(self, pos: np.ndarray, t: float):
+        self.prev_pos = self.curr_pos
+        self.curr_pos = pos
+
+    def predict(self, t: float):
+        delta_t = 0 if self.last_predict is None else (t - self.last_predict) / 1000
+        self.last_predict = t
+
+        if self.prev_pos is not None and np.linalg.norm(self.prev_pos - self.cursor_pos) <= self.min_cursor_movement:
+            self.prev_pos = None
+
+        dist = np.linalg.norm(self.curr_pos - self.cursor_pos)
+        if dist > self.min_cursor_movement:
+            perc = min(1, self.cursor_speed * delta_t / dist)
+            if self.prev_pos is None:
+                # Linear interpolation
+                self.cursor_pos = np.clip(self.cursor_pos + (self.curr_pos - self.cursor_pos) * perc, 0, 1)
+            else:
+                # Quadratic interpolation
+                p1 = self.cursor_pos + (self.prev_pos - self.cursor_pos) * perc
+                p2 = self.prev_pos + (self.curr_pos - self.prev_pos) * perc
+                self.cursor_pos = np.clip(p1 + (p2 - p1) * perc, 0, 1)
+        return self.cursor_pos
+
+
+def smoothing_factor(dt: float, cutoff: float):
+    tau = 1 / (2 * np.pi * cutoff)
+    return 1 / (1 + tau / dt)
+
+"""
+One-Euro filter (Casiez et al.): a low pass filter whose cutoff rises with speed, smooth when the hand is still
+and responsive when it moves. Predictions extrapolate the filtered position along the filtered velocity, up to max_prediction_ms.
+"""
+class OneEuroFilter(CursorFilter):
+    def __init__(self, min_cutoff: float = cfg.ONE_EURO["min_cutoff"], beta: float = cfg.ONE_EURO["beta"], d_cutoff: float = cfg.ONE_EURO["d_cutoff"], max_prediction_ms: float = cfg.ONE_EURO["max_prediction_ms"]):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.max_prediction_ms = max_prediction_ms
+
+    def reset(self, pos: np.ndarray, t: float):
+        self.pos = pos.copy()
+        self.velocity = np.zeros(2)
+        self.t = t
+
+    def update(self, pos: np.ndarray, t: float):
+        dt = (t - self.t) / 1000
+        if dt <= 0:
+            return
+        self.t = t
+
+        # Velocity (screen units / s) is smoothed with a fixed cutoff, the position with a speed dependent one
+        a_d = smoothing_factor(dt, self.d_cutoff)
+        self.velocity += a_d * ((pos - self.pos) / dt - self.velocity)
+
+        a = smoothing_factor(dt, self.min_cutoff + self.beta * np.linalg.norm(self.velocity))
+        self.pos += a * (pos - self.pos)
+
+    def predict(self, t: float):
+        ahead = min(max(t - self.t, 0), self.max_prediction_ms) / 1000
+        return self.pos + self.velocity * ahead
+
+
+"""
+Kalman filter with a constant velocity model, one per axis, driven by white noise acceleration.
+Predictions run the model forward from the last observation to the time asked for, up to max_prediction_ms.
+"""
+class KalmanFilter(CursorFilter):
+    def __init__(self, process_noise: float = cfg.KALMAN["process_noise"], measurement_noise: float = cfg.KALMAN["measurement_noise"], max_prediction_ms: float = cfg.KALMAN["max_prediction_ms"]):
+        self.q = process_noise
+        self.r = measurement_noise ** 2
+        self.max_prediction_ms = max_prediction_ms
+
+    def reset(self, pos: np.ndarray, t: float):
+        self.pos = pos.copy()
+        self.velocity = np.zeros(2)
+        # Covariance terms per axis: position, position/velocity, velocity
+        self.p00 = np.full(2, self.r)
+        self.p01 = np.zeros(2)
+        self.p11 = np.ones(2)
+        self.t = t
+
+    def update(self, pos: np.ndarray, t: float):
+        dt = (t - self.t) / 1000
+        if dt <= 0:
+            return
+        self.t = t
+
+        # Predict
+        self.pos += self.velocity * dt
+        p00 = self.p00 + 2 * dt * self.p01 + dt * dt * self.p11 + self.q * dt ** 3 / 3
+        p01 = self.p01 + dt * self.p11 + self.q * dt ** 2 / 2
+        p11 = self.p11 + self.q * dt
+
+        # Correct
+        s = p00 + self.r
+        k0, k1 = p00 / s, p01 / s
+        innovation = pos - self.pos
+        self.pos += k0 * innovation
+        self.velocity += k1 * innovation
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+
+    def predict(self, t: float):
+        ahead = min(max(t - self.t, 0), self.max_prediction_ms) / 1000
+        return self.pos + self.velocity * ahead
+
+
+FILTERS = dict(
+    interpolate = InterpolationFilter,
+    one_euro = OneEuroFilter,
+    kalman = KalmanFilter,
+)
+
+def create_filter(name: str, cursor_speed: float = .5, min_cursor_movement: float = .01):
+    if name not in FILTERS:
+        raise ValueError(f"Unknown cursor filter {name}, expected one of {', '.join(FILTERS)}")
+    if name == "interpolate":
+        return InterpolationFilter(cursor_speed, min_cursor_movement)
+    return FILTERS[name]()
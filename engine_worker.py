@@ -0,0 +1,122 @@
+import pygame
+import chess
+import chess.engine
+from threading import Thread, Lock
+from queue import Queue
+from typing import NamedTuple
+from timeit import default_timer as timer
+
+import config as cfg
+import utils
+
+
+class Ponder(NamedTuple):
+    board: chess.Board
+    analysis: chess.engine.SimpleAnalysisResult
+    start: float
+
+
+"""
+This class runs the engine search off the main loop.
+Requests take a snapshot of the board, the best move comes back as an ENGINE_MOVE event.
+Every request or cancellation starts a new generation, results from older generations are dropped
+so a takeback or reset while the engine is thinking never gets a stale move played.
+While the player is thinking the engine ponders on the reply it expects, with the same limit as a normal search:
+if the player plays it (ponderhit) that search is already done or well on its way, otherwise it is dropped.
+"""
+class EngineWorker:
+    def __init__(self, engine: chess.engine.SimpleEngine, limit: chess.engine.Limit = None, ponder: bool = cfg.AI_PONDER):
+        self.engine = engine
+        self.limit = limit if limit else chess.engine.Limit(time=cfg.AI_THINK_TIME)
+        self.can_ponder = ponder
+
+        self.requests = Queue()
+        self.lock = Lock()
+        self.generation = 0
+        self.analysis = None
+        self.ponder = None
+
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        self.ponder_saved = 0
+
+        self.t = Thread(target=self.run, args=())
+        self.t.daemon = True
+
+    def start(self):
+        self.t.start()
+
+    def stop(self):
+        self.cancel()
+        self.requests.put(None)
+        self.t.join()
+
+    def request(self, board: chess.Board):
+        with self.lock:
+            self.generation += 1
+            if self.analysis:
+                self.analysis.stop()
+            self.requests.put((self.generation, board.copy()))
+            return self.generation
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            if self.analysis:
+                self.analysis.stop()
+            if self.ponder:
+                self.ponder.analysis.stop()
+                self.ponder = None
+
+    def is_current(self, generation: int):
+        return generation == self.generation
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            generation, board = request
+            with self.lock:
+                if generation != self.generation:
+                    continue # Cancelled before it even started
+
+                ponder, self.ponder = self.ponder, None
+                if ponder and ponder.board.move_stack == board.move_stack and ponder.board.fen() == board.fen():
+                    self.ponder_hits += 1
+                    self.ponder_saved += min(timer() - ponder.start, self.limit.time or 0)
+                    self.analysis = ponder.analysis
+                else:
+                    if ponder:
+                        self.ponder_misses += 1
+                        ponder.analysis.stop()
+                    self.analysis = self.engine.analysis(board, self.limit)
+
+            try:
+                best = self.analysis.wait()
+            except chess.engine.EngineError as e:
+                print("Engine error:", e)
+                best = None
+            finally:
+                with self.lock:
+                    self.analysis.stop()
+                    self.analysis = None
+
+            with self.lock:
+                if best is not None and best.move is not None and generation == self.generation:
+                    pygame.event.post(pygame.event.Event(utils.ENGINE_MOVE, move=best.move, generation=generation))
+
+                    if self.can_ponder and best.ponder is not None:
+                        board.push(best.move)
+                        board.push(best.ponder)
+                        self.ponder = Ponder(board, self.engine.analysis(board, self.limit), timer())
+
+    def stats(self):
+        pondered = self.ponder_hits + self.ponder_misses
+        return dict(
+            ponder_hits = self.ponder_hits,
+            ponder_misses = self.ponder_misses,
+            ponder_hit_rate = self.ponder_hits / pondered if pondered > 0 else None,
+            ponder_saved_s = self.ponder_saved,
+        )
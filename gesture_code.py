@@ -1,97 +1,30 @@
-import cv2 as cv
 import numpy as np
-import mediapipe as mp
-from threading import Thread
+from threading import Thread, Lock
 from collections import deque
 
 import config as cfg
+from hand_features import Hand, FeatureKernel, landmarks_of
+from capture import Capture, downscaled, palm_region, to_frame
+from inference_rate import InferenceRate
+import gesture_process
+import cursor_filter
+import landmark_recording
+from keyframe_tracker import KeyframeTracker
 
 from timeit import default_timer as timer
 
-class Hand:
-    def __init__(self, hand_repr, timestamp_ms, prev_click=False):
-        abs_hand = np.array([(landmark.x, landmark.y, landmark.z) for landmark in hand_repr.hand_landmarks[0]])
-
-        palm = abs_hand[0] * .5 + abs_hand[5] * .125 + abs_hand[9] * .125 + abs_hand[13] * .125 + abs_hand[17] * .125 # Center of palm
-
-        palm_width = np.linalg.norm(abs_hand[5] - abs_hand[17]) # Distance between index and pinky base
-        rel_hand = (abs_hand - palm) / palm_width # Normalize to palm
-
-        wrist = rel_hand[0]
-        index_base = rel_hand[5]
-        middle_base = rel_hand[9]
-        pinky_base = rel_hand[17]
-
-        palm_normal = np.cross(index_base - wrist, pinky_base - wrist)
-        palm_normal = palm_normal / np.linalg.norm(palm_normal)
-        
-        if hand_repr.handedness[0][0].category_name == 'Left':
-            palm_normal = -palm_normal
-
-        pinky_normal = np.cross(palm_normal, middle_base - wrist)
-        pinky_normal = pinky_normal / np.linalg.norm(pinky_normal)
-
-        fingers_normal = np.cross(pinky_normal, palm_normal)
-        fingers_normal = fingers_normal / np.linalg.norm(fingers_normal)
-
-        if hand_repr.handedness[0][0].category_name == 'Left':
-            pinky_normal = -pinky_normal
-
-        basis = np.array([pinky_normal, fingers_normal, palm_normal]).T
-        norm_hand = rel_hand @ basis
-
-        self.abs_hand = abs_hand
-        self.origin = palm
-        self.orig_screen = self.origin[:2]
-        self.basis = basis
-        self.norm_hand = norm_hand
-        self.handedness = hand_repr.handedness[0][0].category_name == 'Right'
-        self.palm_width = palm_width
-        self.timestamp_ms = timestamp_ms
-        self.is_click = self._is_clicking(prev_click)
-
-    def is_same(self, other):
-        if self.handedness != other.handedness:
-            return False
-        
-        if abs(self.palm_width - other.palm_width) > self.palm_width * cfg.MIN_PALM_WIDTH_DIFFERENCE:
-            return False
-        
-        return np.linalg.norm(self.origin - other.origin) < self.palm_width * cfg.MAX_HAND_MOVEMENT
-
-    def is_facing_screen(self):
-        return self.basis[2, 2] < 0
-    
-    def _is_clicking(self, prev_click=False):
-
-        thumb_vec = self.norm_hand[4]
-        index_vec = self.norm_hand[8]
-
-        thumb_vec = thumb_vec / np.linalg.norm(thumb_vec)
-        index_vec = index_vec / np.linalg.norm(index_vec)
-
-        dot = np.dot(thumb_vec, index_vec)
-        dist = np.linalg.norm(thumb_vec - index_vec)
-
-        return dot >= (cfg.DOT_CLICK_HYST if prev_click else cfg.DOT_CLICK) and dist <= (cfg.DIST_CLICK_HYST if prev_click else cfg.DIST_CLICK)
-    
-    def scaled(self, limits):
-        return np.clip((self.orig_screen - limits[0]) / (limits[1] - limits[0]), 0, 1)
-
 class HandDetector:
-    def __init__(self, model_path='hand_landmarker.task', h_flip=False, cursor_speed=.5, delete_gesture_ms=200, end_tracking_ms=700, min_cursor_movement=.01, scales=[[.25,.25],[.75,.75]]):
+    def __init__(self, model_path='hand_landmarker.task', h_flip=False, cursor_speed=.5, delete_gesture_ms=200, end_tracking_ms=700, min_cursor_movement=.01, scales=[[.25,.25],[.75,.75]], on_hand=None, out_of_process=cfg.GESTURE_PROCESS, cursor_filter_name=cfg.CURSOR_FILTER,
+                 record_path=cfg.LANDMARK_RECORDING, replay_source=cfg.LANDMARK_REPLAY, replay_speed=cfg.LANDMARK_REPLAY_SPEED,
+                 keyframes=cfg.KEYFRAME_TRACKING, roi_crop=cfg.ROI_CROP):
         self.h_flip = h_flip
-
-        self.cam = cv.VideoCapture(0)
-        if not self.cam.isOpened():
-            print("Cannot open camera")
-            exit(0)
+        self.on_hand = on_hand
 
         self.scales = np.array(scales)
 
         self.cursor_pos = np.zeros(2, dtype=np.float32)
-        self.min_cursor_movement = min_cursor_movement
-        self.cursor_speed = cursor_speed
+        self.cursor_filter = cursor_filter.create_filter(cursor_filter_name, cursor_speed, min_cursor_movement)
+        self.filtered_hand = None
         self.clicks = deque()
         self.prev_click = False
         self.end_tracking_ms = end_tracking_ms
@@ -100,15 +33,66 @@ class HandDetector:
         self.last_timestamp = None
         self.curr_hand = None
         self.prev_hand = None
-        
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_inferred = 0
+        self.frames_tracked = 0
+        self.inference_delays = deque(maxlen=cfg.FRAME_STATS_WINDOW)
+        self.stopped = True
+        # Hands may come from the landmarker callback and the capture thread at once
+        self.hand_lock = Lock()
+
+        self.recorder = landmark_recording.LandmarkRecorder(record_path) if record_path else None
+
+        # Hands come from exactly one of: a recording, the processes, or capture and landmarking on a thread here
+        self.replay = None
+        self.processes = None
+        self.t = None
+        if replay_source is not None:
+            self.replay = landmark_recording.LandmarkReplay(replay_source, self.add_hand, replay_speed)
+            return
+
+        # Out of process, capture and inference run in processes of their own and only landmarks come back here
+        if out_of_process:
+            self.processes = gesture_process.GestureProcesses(self.add_hand, model_path, h_flip, idle_after_ms=end_tracking_ms, keyframes=keyframes, roi_crop=roi_crop)
+            return
+
+        self.capture = Capture(0, h_flip)
+        if not self.capture.is_opened():
+            # Mouse and voice still work
+            print("Cannot open camera, gestures are disabled")
+            self.capture.release()
+            return
+
+        # Landmarking slows down to probing while no hand is around
+        self.rate = InferenceRate(end_tracking_ms)
+        self.probe_frames = {}
+        # With keyframes, frames in between are tracked on the capture thread, with a kernel of its own
+        self.tracker = KeyframeTracker() if keyframes else None
+        self.tracker_kernel = FeatureKernel()
+        # With a region of interest, only the part of the frame around the last hand found is landmarked
+        self.roi_crop = roi_crop
+        self.roi_hand = None
+        self.submitted_region = None
+
+        import mediapipe as mp
+
         def callback(result: mp.tasks.vision.HandLandmarkerResult, output_image: mp.Image, timestamp_ms: int):
-            if len(result.hand_landmarks) > 0:
-                if self.curr_hand is None:
-                    self.curr_hand = Hand(result, timestamp_ms)
-                else:
-                    self.prev_hand = self.curr_hand
-                    self.curr_hand = Hand(result, timestamp_ms, self.prev_hand.is_click)
-                self.clicks.append((self.curr_hand.is_click, timestamp_ms))
+            found_hand = len(result.hand_landmarks) > 0
+            self.rate.done(timer() * 1000, found_hand)
+            if found_hand:
+                landmarks, handedness = landmarks_of(result)
+                to_frame(landmarks, self.submitted_region, self.capture.frame.shape)
+                self.add_hand(landmarks, handedness, timestamp_ms)
+                self.roi_hand = self.curr_hand
+                if self.tracker:
+                    self.tracker.keyframe_done(landmarks, handedness)
+            else:
+                # Lost, or missed by the region: whole frames until a hand is found again
+                self.roi_hand = None
+                if self.tracker:
+                    self.tracker.keyframe_done()
             self.go = True
                 
 
@@ -120,7 +104,6 @@ class HandDetector:
 
         self.t = Thread(target=self.update, args=())
         self.t.daemon = True
-        self.stopped = True
 
     def set_scales(self, scales):
         self.scales = np.array(scales)
@@ -129,94 +112,163 @@ class HandDetector:
         self.stopped = False
         self.curr_hand = None
         self.prev_hand = None
+        self.filtered_hand = None
         self.clicks = deque()
         self.last_timestamp = None
         self.reset = True
         self.prev_click = False
-        self.t.start()
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_inferred = 0
+        self.frames_tracked = 0
+        if self.replay:
+            self.replay.start()
+        elif self.processes:
+            self.processes.start()
+        elif self.t:
+            self.t.start()
 
     def stop(self):
         self.stopped = True
+        if self.replay:
+            self.replay.stop()
+        if self.processes:
+            self.processes.stop()
+        if self.recorder:
+            self.recorder.close()
+
+    def add_hand(self, landmarks: np.ndarray, handedness: bool, timestamp_ms: int, kernel: FeatureKernel = None):
+        with self.hand_lock:
+            self.inference_delays.append(timer() * 1000 - timestamp_ms)
+            if self.recorder:
+                self.recorder.write(landmarks, handedness, timestamp_ms)
+            if self.curr_hand is None:
+                self.curr_hand = Hand.from_landmarks(landmarks, handedness, timestamp_ms, kernel=kernel)
+            else:
+                self.prev_hand = self.curr_hand
+                self.curr_hand = Hand.from_landmarks(landmarks, handedness, timestamp_ms, self.prev_hand.is_click, kernel)
+            self.clicks.append((self.curr_hand.is_click, timestamp_ms))
+        if self.on_hand:
+            self.on_hand()
 
     def update(self):
+        import mediapipe as mp
         self.go = True
         while not self.stopped:
-            self.grabbed, self.frame = self.cam.read()
+            # Every frame is grabbed to keep up with the camera, only the ones submitted to the landmarker are decoded
+            self.grabbed = self.capture.grab()
             if self.grabbed is False:
                 print('No frames to read')
                 self.stopped = True
                 break
-
-            if self.h_flip:
-                self.frame = cv.flip(self.frame, 1)
-            if self.go:
-                self.frame.flags.writeable = False
-                self.go = False
-                self.hand_landmarker.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data= cv.cvtColor(self.frame, cv.COLOR_BGR2RGB)), int(timer() * 1000))
-
-        self.cam.release()
+            self.frames_captured += 1
+
+            now_ms = timer() * 1000
+            keyframe = self.go and self.rate.wait_ms(now_ms) == 0 and (self.tracker is None or self.tracker.wants_keyframe())
+            # Between keyframes, and while one is landmarked, the hand is followed with optical flow
+            track = not keyframe and self.tracker is not None and self.tracker.is_tracking()
+            if not keyframe and not track:
+                self.frames_dropped += 1
+                continue
+
+            region = None
+            if keyframe and self.roi_crop and self.roi_hand is not None:
+                region = palm_region(self.roi_hand, self.capture.frame.shape)
+            # Flow needs whole frames, otherwise only the region is converted
+            image = self.capture.retrieve(region=None if self.tracker else region)
+            if image is None:
+                self.frames_dropped += 1
+                continue
+            if track:
+                self.track_frame(image)
+                continue
+            if self.tracker:
+                self.tracker.keyframe_submitted(image)
+                if region is not None:
+                    x0, y0, x1, y1 = region
+                    image = np.ascontiguousarray(image[y0:y1, x0:x1])
+            image = downscaled(image, self.rate.scale(now_ms), self.probe_frames)
+            self.submitted_region = region
+            self.go = False
+            self.frames_inferred += 1
+            self.rate.submitted(now_ms)
+            self.hand_landmarker.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data=image), int(timer() * 1000))
+
+        self.capture.release()
+
+    def track_frame(self, image):
+        tracked = self.tracker.track(image)
+        if tracked is None:
+            self.frames_dropped += 1
+            return
+        self.frames_tracked += 1
+        self.add_hand(*tracked, int(timer() * 1000), self.tracker_kernel)
+        self.roi_hand = self.curr_hand
+
+    def stats(self):
+        if self.replay:
+            stats = dict(hands_replayed = self.replay.replayed)
+        elif self.processes:
+            stats = self.processes.stats()
+        else:
+            stats = dict(
+                frames_captured = self.frames_captured,
+                frames_dropped = self.frames_dropped,
+                frames_inferred = self.frames_inferred,
+                frames_tracked = self.frames_tracked,
+                drop_rate = self.frames_dropped / self.frames_captured if self.frames_captured > 0 else None,
+            )
+            if self.t:
+                stats.update(self.rate.stats(timer() * 1000))
+        # From grabbing a frame to its landmarks being received, the cursor filter only extrapolates over max_prediction_ms of it
+        stats["inference_delay_ms_p50"] = float(np.percentile(self.inference_delays, 50)) if self.inference_delays else None
+        return stats
     
     def process_gestures(self, curr_time_ms):
-        if self.last_timestamp is None:
-            self.last_timestamp = curr_time_ms
-
-        delta_t = (curr_time_ms - self.last_timestamp) / 1000
         self.last_timestamp = curr_time_ms
 
-        if self.curr_hand is None:
+        hand = self.curr_hand
+        if hand is None:
             return (None, False, False, -1000)
-        
-        if self.reset:
-            self.reset = False
-            self.cursor_pos = self.curr_hand.scaled(self.scales)
-        
-        if not self.prev_hand is None:
-            if not self.prev_hand.is_same(self.curr_hand):
-                pass # Do something? Hands are different!
-
-            dist = np.linalg.norm(self.prev_hand.scaled(self.scales) - self.cursor_pos)
-            if dist <= self.min_cursor_movement:
-                self.prev_hand = None
 
+        # Hands are timestamped when their frame was grabbed, the camera saw them a bit earlier
+        seen_ms = hand.timestamp_ms - cfg.CAMERA_LATENCY_MS
+        if self.reset or (hand is not self.filtered_hand and not self.filtered_hand.is_same(hand)):
+            # Nothing to smooth or extrapolate from when tracking starts or jumps to another hand
+            self.reset = False
+            self.cursor_filter.reset(hand.scaled(self.scales), seen_ms)
+        elif hand is not self.filtered_hand:
+            self.cursor_filter.update(hand.scaled(self.scales), seen_ms)
+        self.filtered_hand = hand
 
-        dist = np.linalg.norm(self.curr_hand.scaled(self.scales) - self.cursor_pos)
-        if self.prev_hand is None:
-            # Linear interpolation
-            if dist > self.min_cursor_movement:
-                perc = min(1, self.cursor_speed * delta_t / dist)
-                self.cursor_pos = np.clip(self.cursor_pos + (self.curr_hand.scaled(self.scales) - self.cursor_pos) * perc ,0,1)
-        else:
-            # Quadratic interpolation
-            if dist > self.min_cursor_movement:
-                perc = min(1, self.cursor_speed * delta_t / dist)
-
-                p1 = self.cursor_pos + (self.prev_hand.scaled(self.scales) - self.cursor_pos) * perc
-                p2 = self.prev_hand.scaled(self.scales) + (self.curr_hand.scaled(self.scales) - self.prev_hand.scaled(self.scales)) * perc
-
-                self.cursor_pos = np.clip(p1 + (p2 - p1) * perc, 0, 1)
+        # Extrapolated towards now, the time the frame is drawn, at most the filter's max_prediction_ms past the hand
+        self.cursor_pos = np.clip(self.cursor_filter.predict(curr_time_ms), 0, 1)
 
         # self.curr_hand.return_index_thumb()
 
-        while len(self.clicks) > 0:
-            click, timestamp = self.clicks[0]
-            if timestamp + self.delete_gesture_ms >= curr_time_ms:
-                break
-            self.clicks.popleft() 
+        # Hands, and their clicks, may be added from other threads meanwhile
+        with self.hand_lock:
+            while len(self.clicks) > 0:
+                click, timestamp = self.clicks[0]
+                if timestamp + self.delete_gesture_ms >= curr_time_ms:
+                    break
+                self.clicks.popleft() 
 
-        is_click = False
-        for click, timestamp in self.clicks:
-            is_click = is_click or click
+            is_click = False
+            for click, timestamp in self.clicks:
+                is_click = is_click or click
 
         release = self.prev_click and not is_click
         click = not self.prev_click and is_click
         self.prev_click = is_click
 
-        check = self.curr_hand.timestamp_ms + self.end_tracking_ms >= curr_time_ms
+        check = hand.timestamp_ms + self.end_tracking_ms >= curr_time_ms
         if not check:
-            self.curr_hand = None
-            self.prev_hand = None
-            self.click = deque()
+            with self.hand_lock:
+                self.curr_hand = None
+                self.prev_hand = None
+                self.clicks.clear()
             self.prev_click = False
             self.reset = True
             return (None, False, False, -1000)
-        return self.cursor_pos, click, release, self.curr_hand.timestamp_ms
\ No newline at end of file
+        return self.cursor_pos, click, release, hand.timestamp_ms
\ No newline at end of file
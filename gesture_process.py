@@ -0,0 +1,284 @@
+import os
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from threading import Thread, Event, Lock
+from timeit import default_timer as timer
+
+import config as cfg
+from hand_features import LANDMARK_DTYPE
+
+
+CAPTURED, DROPPED, INFERRED, TRACKED = range(4)
+# Inference rate stats the inference process shares
+IDLE, INFERENCE_FPS, INFERENCE_BUSY_FRACTION, INFERENCE_BUSY_FRACTION_TOTAL = range(4)
+
+
+"""
+Ring of frames in shared memory, every slot is exposed as a numpy view so frames are written and read in place.
+The process creating the ring owns it, others attach to it by name.
+"""
+class FrameRing:
+    def __init__(self, shape, slots: int, name: str = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_size = int(np.prod(self.shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=frame_size * slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = name is None
+        self.frames = [np.ndarray(self.shape, np.uint8, buffer=self.shm.buf, offset=i * frame_size) for i in range(slots)]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.frames = None # Views have to go before the buffer is closed
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def capture_loop(frame_conn, wanted, stop, counters, shared_region, camera: int, h_flip: bool, slots: int):
+    # Capture process: frames the inference process asked for are converted straight into the next slot of the ring,
+    # only the region it asked for (x1 > 0) if any
+    from capture import Capture, contiguous_view
+
+    capture = Capture(camera, h_flip)
+    shape = capture.frame_shape() if capture.is_opened() else None
+    if shape is None:
+        print("Cannot open camera")
+        frame_conn.close()
+        return
+
+    ring = FrameRing(shape, slots)
+    try:
+        frame_conn.send(("ring", ring.name, ring.shape, ring.slots))
+        slot = 0
+        while not stop.is_set():
+            if not capture.grab():
+                print('No frames to read')
+                break
+            counters[CAPTURED] += 1
+
+            if not wanted.is_set():
+                counters[DROPPED] += 1
+                continue
+            x0, y0, x1, y1 = region = tuple(shared_region)
+            if x1 > 0:
+                frame = contiguous_view(ring.frames[slot], (y1 - y0, x1 - x0) + ring.shape[2:])
+            else:
+                region, frame = None, ring.frames[slot]
+            if capture.retrieve(frame, region) is None:
+                counters[DROPPED] += 1
+                continue
+            wanted.clear()
+            frame_conn.send(("frame", slot, int(timer() * 1000), region))
+            slot = (slot + 1) % ring.slots
+    finally:
+        frame_conn.close()
+        capture.release()
+        ring.close()
+
+
+def inference_loop(frame_conn, result_conn, wanted, stop, counters, rates, shared_region, model_path: str, idle_after_ms: float, keyframes: bool, roi_crop: bool):
+    # Inference process: landmarks frames from the ring, sends back one compact record per hand found.
+    # It asks for the next frame as soon as a result is in, or at the probe rate while no hand is around.
+    # With keyframes, frames in between and while a keyframe is landmarked are tracked with optical flow.
+    # With a region of interest, only the part of the frame around the last hand found is landmarked: cropped by
+    # the capture process, or here when flow needs whole frames
+    import mediapipe as mp
+    from hand_features import Hand, FeatureKernel, landmarks_of
+    from capture import contiguous_view, downscaled, palm_region, to_frame
+    from inference_rate import InferenceRate
+    from keyframe_tracker import KeyframeTracker
+
+    rate = InferenceRate(idle_after_ms)
+    tracker = KeyframeTracker() if keyframes else None
+    probe_frames = {}
+    ready = Event()
+    landmarking = Event()
+    # Landmarks are sent from the landmarker callback and from this thread when tracking
+    send_lock = Lock()
+    records = [np.zeros(1, LANDMARK_DTYPE) for _ in range(2)]
+    roi_kernel = FeatureKernel()
+    # Region of the frame being landmarked and the last hand landmarked, the region of the next one is around it
+    last = dict(region=None, hand=None)
+
+    def share_region(hand):
+        # Region the capture process converts next, the whole frame (zeros) when the hand is lost
+        region = palm_region(hand, ring.shape) if roi_crop and hand is not None and not keyframes else None
+        shared_region[:] = region or (0, 0, 0, 0)
+
+    def send(record, landmarks, handedness: bool, timestamp_ms: int):
+        record["timestamp_ms"] = timestamp_ms
+        record["is_right"] = handedness
+        record["landmarks"] = landmarks
+        with send_lock:
+            result_conn.send_bytes(record.tobytes())
+
+    def ask_for_frame(now_ms):
+        if landmarking.is_set():
+            # Frames keep coming while a keyframe is landmarked only if the hand is followed meanwhile
+            if tracker and tracker.is_tracking():
+                wanted.set()
+        elif rate.wait_ms(now_ms) == 0:
+            wanted.set()
+        else:
+            ready.set() # Asked for by the loop below once the probe is due
+
+    def callback(result, output_image, timestamp_ms: int):
+        now_ms = timer() * 1000
+        found_hand = len(result.hand_landmarks) > 0
+        rate.done(now_ms, found_hand)
+        if found_hand:
+            landmarks, handedness = landmarks_of(result)
+            to_frame(landmarks, last["region"], ring.shape)
+            send(records[0], landmarks, handedness, timestamp_ms)
+            if tracker:
+                tracker.keyframe_done(landmarks, handedness)
+            last["hand"] = Hand.from_landmarks(landmarks, handedness, timestamp_ms, kernel=roi_kernel) if roi_crop else None
+        else:
+            last["hand"] = None
+            if tracker:
+                tracker.keyframe_done()
+        share_region(last["hand"])
+        landmarking.clear()
+        stats = rate.stats(now_ms)
+        rates[:] = [stats["idle"], stats["inference_fps"], stats["inference_busy_fraction"], stats["inference_busy_fraction_total"] or 0]
+        if rate.wait_ms(now_ms) == 0:
+            wanted.set()
+        else:
+            ready.set()
+
+    options = mp.tasks.vision.HandLandmarkerOptions(
+        base_options=mp.tasks.BaseOptions(model_asset_path=model_path),
+        running_mode=mp.tasks.vision.RunningMode.LIVE_STREAM,
+        result_callback=callback)
+    hand_landmarker = mp.tasks.vision.HandLandmarker.create_from_options(options)
+
+    ring = None
+    try:
+        wanted.set()
+        while not stop.is_set():
+            timeout = .1
+            if ready.is_set():
+                wait_ms = rate.wait_ms(timer() * 1000)
+                if wait_ms == 0:
+                    ready.clear()
+                    wanted.set()
+                else:
+                    timeout = min(wait_ms / 1000, timeout)
+            if not frame_conn.poll(timeout):
+                continue
+            try:
+                message = frame_conn.recv()
+            except EOFError:
+                break # Capture is gone
+
+            if message[0] == "ring":
+                _, name, shape, slots = message
+                try:
+                    ring = FrameRing(shape, slots, name)
+                except FileNotFoundError:
+                    break # Capture is already gone
+            else:
+                _, slot, timestamp_ms, region = message
+                now_ms = timer() * 1000
+                frame = ring.frames[slot] if region is None else contiguous_view(ring.frames[slot], (region[3] - region[1], region[2] - region[0]) + ring.shape[2:])
+                if tracker and (landmarking.is_set() or not tracker.wants_keyframe()):
+                    tracked = tracker.track(frame)
+                    if tracked is None:
+                        counters[DROPPED] += 1
+                    else:
+                        counters[TRACKED] += 1
+                        send(records[1], *tracked, timestamp_ms)
+                    ask_for_frame(now_ms)
+                    continue
+
+                counters[INFERRED] += 1
+                if tracker:
+                    tracker.keyframe_submitted(frame)
+                    region = palm_region(tracker.hand or last["hand"], ring.shape) if roi_crop else None
+                    if region is not None:
+                        x0, y0, x1, y1 = region
+                        frame = np.ascontiguousarray(frame[y0:y1, x0:x1])
+                last["region"] = region
+                landmarking.set()
+                rate.submitted(now_ms)
+                # mp.Image copies the frame, so the slot can be written again as soon as the next frame is asked for
+                hand_landmarker.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data=downscaled(frame, rate.scale(now_ms), probe_frames)), timestamp_ms)
+                ask_for_frame(now_ms)
+    finally:
+        hand_landmarker.close()
+        result_conn.close()
+        if ring:
+            ring.close()
+
+
+"""
+Capture and inference of a HandDetector, run in two processes of their own so they never hold up the main loop.
+The capture process writes the frames the inference process asks for into a shared memory ring,
+the inference process hands them to MediaPipe (mp.Image takes a copy) and sends back a LANDMARK_DTYPE record per hand, handed to on_landmarks.
+"""
+class GestureProcesses:
+    def __init__(self, on_landmarks, model_path: str, h_flip: bool, camera: int = 0, slots: int = cfg.FRAME_RING_SLOTS, idle_after_ms: float = 700, keyframes: bool = False, roi_crop: bool = False):
+        self.on_landmarks = on_landmarks
+
+        frame_recv, frame_send = multiprocessing.Pipe(duplex=False)
+        self.result_conn, result_send = multiprocessing.Pipe(duplex=False)
+        # Set by the inference process when it is ready for the next frame
+        self.wanted = multiprocessing.Event()
+        self.stop_event = multiprocessing.Event()
+        self.counters = multiprocessing.Array("q", 4)
+        self.rates = multiprocessing.Array("d", 4)
+        # Pixel bounds (x0, y0, x1, y1) of the region of the next frame to landmark, zeros for the whole frame
+        self.region = multiprocessing.Array("i", 4)
+
+        self.capture = multiprocessing.Process(target=capture_loop, args=(frame_send, self.wanted, self.stop_event, self.counters, self.region, camera, h_flip, slots), daemon=True)
+        self.inference = multiprocessing.Process(target=inference_loop, args=(frame_recv, result_send, self.wanted, self.stop_event, self.counters, self.rates, self.region, model_path, idle_after_ms, keyframes, roi_crop), daemon=True)
+        self.child_conns = [frame_recv, frame_send, result_send]
+
+        self.t = Thread(target=self.read_results, args=())
+        self.t.daemon = True
+
+    def start(self):
+        if os.name == "posix":
+            # Both processes have to share one tracker of the ring's shared memory, or the one attaching to it reports it leaked
+            resource_tracker.ensure_running()
+        self.capture.start()
+        self.inference.start()
+        for conn in self.child_conns:
+            conn.close() # Only the children use them, closing them here lets EOF through when a child exits
+        self.t.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.capture.join()
+        self.inference.join()
+
+    def read_results(self):
+        while True:
+            try:
+                data = self.result_conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            record = np.frombuffer(data, LANDMARK_DTYPE)[0]
+            self.on_landmarks(record["landmarks"], bool(record["is_right"]), int(record["timestamp_ms"]))
+
+    def stats(self):
+        captured, dropped, inferred, tracked = self.counters[:]
+        idle, inference_fps, inference_busy_fraction, inference_busy_fraction_total = self.rates[:]
+        return dict(
+            frames_captured = captured,
+            frames_dropped = dropped,
+            frames_inferred = inferred,
+            frames_tracked = tracked,
+            drop_rate = dropped / captured if captured > 0 else None,
+            idle = bool(idle),
+            inference_fps = inference_fps,
+            inference_busy_fraction = inference_busy_fraction,
+            inference_busy_fraction_total = inference_busy_fraction_total,
+        )
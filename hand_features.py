@@ -0,0 +1,178 @@
+import numpy as np
+from itertools import chain
+
+import config as cfg
+
+
+N_LANDMARKS = 21
+
+# Center of the palm: halfway between the wrist and the average of the four finger bases
+PALM_WEIGHTS = np.zeros(N_LANDMARKS)
+PALM_WEIGHTS[0] = .5
+PALM_WEIGHTS[[5, 9, 13, 17]] = .125
+
+# Compact landmark record of one hand, what the inference process hands back
+LANDMARK_DTYPE = np.dtype([
+    ("timestamp_ms", np.int64),
+    ("is_right", np.bool_),
+    ("landmarks", np.float32, (N_LANDMARKS, 3)),
+])
+
+FEATURE_DTYPE = np.dtype([
+    ("abs_hand", np.float64, (N_LANDMARKS, 3)),
+    ("origin", np.float64, 3),
+    ("palm_width", np.float64),
+    ("basis", np.float64, (3, 3)),
+    ("norm_hand", np.float64, (N_LANDMARKS, 3)),
+    ("click_dot", np.float64),
+    ("click_dist", np.float64),
+])
+
+
+def _cross(a, b, out):
+    out[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+    out[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+    out[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+def _normalize(v, norm):
+    np.sqrt(np.einsum("ij,ij->i", v, v, out=norm), out=norm)
+    v /= norm[:, None]
+
+
+"""
+Turns landmark buffers of any number of hands into their features in one pass:
+palm origin and width, palm basis, hand normalized to its palm, and the thumb/index features the click is decided on.
+Scratch buffers are kept between calls, each call allocates a single record array the Hands built from it share.
+Not thread safe, every thread feeding hands needs its own kernel.
+"""
+class FeatureKernel:
+    def __init__(self, capacity: int = 1):
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int):
+        self.capacity = capacity
+        self.rel_hand = np.empty((capacity, N_LANDMARKS, 3))
+        self.edges = np.empty((3, capacity, 3))
+        self.norms = np.empty(capacity)
+        self.tips = np.empty((2, capacity, 3))
+
+    def __call__(self, landmarks: np.ndarray, is_right: np.ndarray):
+        """
+        landmarks: (n, 21, 3) in camera coordinates, is_right: (n,) handedness. Returns n FEATURE_DTYPE records.
+        """
+        n = len(landmarks)
+        if n > self.capacity:
+            self.allocate(n)
+        features = np.empty(n, FEATURE_DTYPE)
+        rel_hand, norms = self.rel_hand[:n], self.norms[:n]
+        wrist_to_index, wrist_to_pinky, wrist_to_middle = self.edges[:, :n]
+        thumb, index = self.tips[:, :n]
+
+        abs_hand = features["abs_hand"]
+        abs_hand[:] = landmarks
+        origin = features["origin"]
+        origin[:] = np.einsum("l,nlc->nc", PALM_WEIGHTS, abs_hand)
+
+        # Distance between index and pinky base
+        palm_width = features["palm_width"]
+        np.subtract(abs_hand[:, 5], abs_hand[:, 17], out=wrist_to_index)
+        np.sqrt(np.einsum("ij,ij->i", wrist_to_index, wrist_to_index), out=palm_width)
+
+        np.subtract(abs_hand, origin[:, None], out=rel_hand)
+        rel_hand /= palm_width[:, None, None]
+
+        np.subtract(rel_hand[:, 5], rel_hand[:, 0], out=wrist_to_index)
+        np.subtract(rel_hand[:, 17], rel_hand[:, 0], out=wrist_to_pinky)
+        np.subtract(rel_hand[:, 9], rel_hand[:, 0], out=wrist_to_middle)
+
+        # Columns of the basis: pinky side, fingers direction and palm normal, mirrored for left hands
+        basis = features["basis"]
+        palm_normal, pinky_normal, fingers_normal = basis[:, :, 2], basis[:, :, 0], basis[:, :, 1]
+        _cross(wrist_to_index, wrist_to_pinky, palm_normal)
+        _normalize(palm_normal, norms)
+        palm_normal[~is_right] *= -1
+
+        _cross(palm_normal, wrist_to_middle, pinky_normal)
+        _normalize(pinky_normal, norms)
+
+        _cross(pinky_normal, palm_normal, fingers_normal)
+        _normalize(fingers_normal, norms)
+        pinky_normal[~is_right] *= -1
+
+        norm_hand = features["norm_hand"]
+        norm_hand[:] = np.matmul(rel_hand, basis)
+
+        thumb[:] = norm_hand[:, 4]
+        index[:] = norm_hand[:, 8]
+        _normalize(thumb, norms)
+        _normalize(index, norms)
+        np.einsum("ij,ij->i", thumb, index, out=features["click_dot"])
+        thumb -= index
+        np.sqrt(np.einsum("ij,ij->i", thumb, thumb), out=features["click_dist"])
+        return features
+
+
+def landmarks_of(result):
+    # First hand of a MediaPipe HandLandmarkerResult as a (21, 3) array, with its handedness (True for right)
+    landmarks = np.fromiter(chain.from_iterable((landmark.x, landmark.y, landmark.z) for landmark in result.hand_landmarks[0]), dtype=np.float64, count=N_LANDMARKS * 3)
+    return landmarks.reshape(N_LANDMARKS, 3), result.handedness[0][0].category_name == 'Right'
+
+
+def is_clicking(click_dot, click_dist, prev_click=False):
+    # Thumb and index tips pointing the same way and close together, with hysteresis while already clicking
+    return (click_dot >= (cfg.DOT_CLICK_HYST if prev_click else cfg.DOT_CLICK)) & (click_dist <= (cfg.DIST_CLICK_HYST if prev_click else cfg.DIST_CLICK))
+
+
+def scaled_positions(origins: np.ndarray, limits: np.ndarray):
+    # Palm positions mapped from the [limits[0], limits[1]] region of the camera image to [0, 1]
+    return np.clip((origins[..., :2] - limits[0]) / (limits[1] - limits[0]), 0, 1)
+
+
+"""
+A hand seen at some time, as a value object over one record of the feature kernel.
+"""
+class Hand:
+    __slots__ = ("features", "abs_hand", "origin", "orig_screen", "basis", "norm_hand", "palm_width",
+                 "handedness", "timestamp_ms", "is_click", "scaled_limits", "scaled_pos")
+
+    def __init__(self, features: np.void, handedness: bool, timestamp_ms: int, prev_click: bool = False):
+        self.features = features
+        self.abs_hand = features["abs_hand"]
+        self.origin = features["origin"]
+        self.orig_screen = self.origin[:2]
+        self.basis = features["basis"]
+        self.norm_hand = features["norm_hand"]
+        self.palm_width = float(features["palm_width"])
+        self.handedness = handedness # True for a right hand
+        self.timestamp_ms = timestamp_ms
+        self.is_click = bool(is_clicking(features["click_dot"], features["click_dist"], prev_click))
+        self.scaled_limits = None
+        self.scaled_pos = None
+
+    @classmethod
+    def from_landmarks(cls, landmarks: np.ndarray, handedness: bool, timestamp_ms: int, prev_click: bool = False, kernel: FeatureKernel = None):
+        features = (kernel or KERNEL)(landmarks[None], np.array([handedness]))
+        return cls(features[0], handedness, timestamp_ms, prev_click)
+
+    def is_same(self, other):
+        if self.handedness != other.handedness:
+            return False
+
+        if abs(self.palm_width - other.palm_width) > self.palm_width * cfg.MIN_PALM_WIDTH_DIFFERENCE:
+            return False
+
+        return np.linalg.norm(self.origin - other.origin) < self.palm_width * cfg.MAX_HAND_MOVEMENT
+
+    def is_facing_screen(self):
+        return self.basis[2, 2] < 0
+
+    def scaled(self, limits):
+        # The same limits are asked for several times per frame, the position is only computed once
+        if limits is not self.scaled_limits:
+            self.scaled_limits = limits
+            self.scaled_pos = scaled_positions(self.origin, limits)
+        return self.scaled_pos
+
+
+# Kernel of the thread delivering landmarks
+KERNEL = FeatureKernel()
@@ -0,0 +1,61 @@
+from collections import deque
+
+import config as cfg
+
+
+"""
+Duty cycle of hand landmarking. While a hand is around every frame is landmarked, as soon as the previous one is done;
+once none was found for idle_after_ms, only probe_fps frames/s are, at probe_scale resolution, until a hand shows up.
+Times are in ms, the busy fraction is the fraction of wall-clock time an inference was in flight, not CPU time
+(MediaPipe may spread one over several threads, or wait on the GPU).
+Submissions and results may come from different threads.
+"""
+class InferenceRate:
+    def __init__(self, idle_after_ms: float, probe_fps: float = cfg.IDLE_PROBE_FPS, probe_scale: float = cfg.IDLE_PROBE_SCALE):
+        self.idle_after_ms = idle_after_ms
+        self.probe_ms = 1000 / probe_fps
+        self.probe_scale = probe_scale
+        self.last_hand_ms = float("-inf")
+        self.last_submit_ms = float("-inf")
+        self.pending_ms = None
+        self.started_ms = None
+        self.busy_ms = 0.
+        # (submitted, done) of the last inferences
+        self.inferences = deque(maxlen=cfg.FRAME_STATS_WINDOW)
+
+    def is_idle(self, now_ms: float):
+        return now_ms - self.last_hand_ms > self.idle_after_ms
+
+    def wait_ms(self, now_ms: float):
+        # Time until the next frame can be submitted
+        if not self.is_idle(now_ms):
+            return 0
+        return max(self.last_submit_ms + self.probe_ms - now_ms, 0)
+
+    def scale(self, now_ms: float):
+        return self.probe_scale if self.is_idle(now_ms) else 1.
+
+    def submitted(self, now_ms: float):
+        if self.started_ms is None:
+            self.started_ms = now_ms
+        self.last_submit_ms = self.pending_ms = now_ms
+
+    def done(self, now_ms: float, found_hand: bool):
+        if found_hand:
+            self.last_hand_ms = now_ms
+        if self.pending_ms is not None:
+            self.inferences.append((self.pending_ms, now_ms))
+            self.busy_ms += now_ms - self.pending_ms
+            self.pending_ms = None
+
+    def stats(self, now_ms: float, window_ms: float = 1000):
+        # Rate and busy fraction over the last window, busy fraction since the first submission
+        window_start = now_ms - window_ms
+        recent = [(start, end) for start, end in list(self.inferences) if end >= window_start]
+        elapsed = now_ms - self.started_ms if self.started_ms is not None else 0
+        return dict(
+            idle = self.is_idle(now_ms),
+            inference_fps = len(recent) * 1000 / window_ms,
+            inference_busy_fraction = sum(end - max(start, window_start) for start, end in recent) / window_ms,
+            inference_busy_fraction_total = self.busy_ms / elapsed if elapsed > 0 else None,
+        )
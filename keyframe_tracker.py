@@ -0,0 +1,102 @@
+import cv2 as cv
+import numpy as np
+
+import config as cfg
+from hand_features import Hand, FeatureKernel, N_LANDMARKS
+
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3, criteria=(cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 20, .03))
+
+
+"""
+Follows a hand between keyframes: the landmarks of the last keyframe are carried over to the following frames with
+sparse optical flow (pyramidal Lucas-Kanade) instead of running the landmarker on each of them.
+Tracking is lost, and a keyframe wanted, when too few landmarks are tracked both ways consistently or the tracked hand
+is no longer the same hand (Hand.is_same), otherwise a keyframe is wanted every interval frames.
+Keyframe results may arrive on another thread, they are applied by the thread tracking frames.
+"""
+class KeyframeTracker:
+    def __init__(self, interval: int = cfg.KEYFRAME_INTERVAL):
+        self.interval = interval
+        self.kernel = FeatureKernel()
+        self.hand = None
+        self.handedness = None
+        self.points = None
+        self.depths = None
+        self.frames_since_keyframe = 0
+        self.pending = None
+
+        self.key_gray = None
+        self.prev_gray = None
+        self.curr_gray = None
+        self.landmarks = np.empty((N_LANDMARKS, 3))
+
+    def keyframe_submitted(self, frame: np.ndarray):
+        # The RGB frame sent to the landmarker, kept in gray to track from once its landmarks are in
+        self.apply_pending()
+        if self.key_gray is None or self.key_gray.shape != frame.shape[:2]:
+            self.key_gray = np.empty(frame.shape[:2], np.uint8)
+            self.prev_gray = np.empty_like(self.key_gray)
+            self.curr_gray = np.empty_like(self.key_gray)
+        cv.cvtColor(frame, cv.COLOR_RGB2GRAY, dst=self.key_gray)
+
+    def keyframe_done(self, landmarks: np.ndarray = None, handedness: bool = None):
+        # Landmarks of the last keyframe submitted, None when it had no hand
+        self.pending = (None if landmarks is None else np.array(landmarks), handedness)
+
+    def apply_pending(self):
+        if self.pending is None:
+            return
+        (landmarks, handedness), self.pending = self.pending, None
+        if landmarks is None:
+            self.lose()
+            return
+        size = np.array(self.key_gray.shape[::-1], np.float32)
+        self.points = (landmarks[:, :2] * size).astype(np.float32)
+        self.depths = landmarks[:, 2].copy()
+        self.handedness = handedness
+        self.hand = Hand.from_landmarks(landmarks, handedness, 0, kernel=self.kernel)
+        self.prev_gray[:] = self.key_gray
+        self.frames_since_keyframe = 0
+
+    def lose(self):
+        self.hand = None
+        return None
+
+    def is_tracking(self):
+        self.apply_pending()
+        return self.hand is not None
+
+    def wants_keyframe(self):
+        self.apply_pending()
+        return self.hand is None or self.frames_since_keyframe >= self.interval
+
+    def track(self, frame: np.ndarray):
+        # Landmarks (normalized like the landmarker's) and handedness of the hand in this RGB frame, None if lost
+        if not self.is_tracking() or frame.shape[:2] != self.key_gray.shape:
+            return self.lose()
+        cv.cvtColor(frame, cv.COLOR_RGB2GRAY, dst=self.curr_gray)
+
+        points, status, _ = cv.calcOpticalFlowPyrLK(self.prev_gray, self.curr_gray, self.points, None, **LK_PARAMS)
+        back, back_status, _ = cv.calcOpticalFlowPyrLK(self.curr_gray, self.prev_gray, points, None, **LK_PARAMS)
+
+        # Landmarks that come back where they started from are trusted, the rest follow their median motion
+        palm_width = np.linalg.norm(self.points[5] - self.points[17])
+        error = np.linalg.norm(back - self.points, axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < palm_width * cfg.FLOW_MAX_ERROR)
+        if good.mean() < cfg.FLOW_MIN_TRACKED:
+            return self.lose()
+        points[~good] = self.points[~good] + np.median(points[good] - self.points[good], axis=0)
+
+        size = self.curr_gray.shape[::-1]
+        self.landmarks[:, :2] = points / size
+        self.landmarks[:, 2] = self.depths
+        hand = Hand.from_landmarks(self.landmarks, self.handedness, 0, kernel=self.kernel)
+        if not self.hand.is_same(hand):
+            return self.lose()
+
+        self.hand = hand
+        self.points = points
+        self.prev_gray, self.curr_gray = self.curr_gray, self.prev_gray
+        self.frames_since_keyframe += 1
+        return self.landmarks, self.handedness
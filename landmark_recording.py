@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from threading import Thread, Event, Lock
+from timeit import default_timer as timer
+
+from hand_features import LANDMARK_DTYPE
+
+
+# A recording is this magic followed by LANDMARK_DTYPE records back to back, one per hand landmarked
+MAGIC = b"HANDLMK1"
+
+
+"""
+Writes the landmark stream of a HandDetector to a recording, one record per hand as it arrives.
+"""
+class LandmarkRecorder:
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.record = np.zeros(1, LANDMARK_DTYPE)
+        # Hands arrive on the landmarking thread, the recording is closed from the main one
+        self.lock = Lock()
+
+    def write(self, landmarks: np.ndarray, handedness: bool, timestamp_ms: int):
+        with self.lock:
+            if self.file is None:
+                return
+            self.record["timestamp_ms"] = timestamp_ms
+            self.record["is_right"] = handedness
+            self.record["landmarks"] = landmarks
+            self.file.write(self.record.tobytes())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load(path: str):
+    # Memory maps a recording as a LANDMARK_DTYPE array, a last record cut short (interrupted recording) is left out
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a landmark recording")
+    count = (os.path.getsize(path) - len(MAGIC)) // LANDMARK_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, LANDMARK_DTYPE)
+    return np.memmap(path, LANDMARK_DTYPE, mode="r", offset=len(MAGIC), shape=(count,))
+
+
+def replay_times(records: np.ndarray, start_ms: float, speed: float = 1.):
+    # Times the records are replayed at, starting at start_ms and keeping the recorded pace sped up by speed
+    timestamps = records["timestamp_ms"]
+    return start_ms + (timestamps - timestamps[0]) / speed
+
+
+"""
+Replays a recording (path or loaded records) through on_landmarks(landmarks, handedness, timestamp_ms) from a thread
+of its own, the way live landmarking delivers hands. Records are timestamped with the time they are replayed at,
+so gestures are timed as if they happened now, speed > 1 replays faster than recorded.
+"""
+class LandmarkReplay:
+    def __init__(self, recording, on_landmarks, speed: float = 1., loop: bool = False):
+        self.records = load(recording) if isinstance(recording, str) else recording
+        self.on_landmarks = on_landmarks
+        self.speed = speed
+        self.loop = loop
+        self.replayed = 0
+        self.stop_event = Event()
+
+        self.t = Thread(target=self.run, args=())
+        self.t.daemon = True
+
+    def start(self):
+        self.t.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_done(self):
+        return not self.t.is_alive()
+
+    def run(self):
+        if len(self.records) == 0:
+            return
+        while not self.stop_event.is_set():
+            times = replay_times(self.records, timer() * 1000, self.speed)
+            for record, t in zip(self.records, times):
+                if self.stop_event.wait(max(t - timer() * 1000, 0) / 1000):
+                    return
+                self.on_landmarks(record["landmarks"], bool(record["is_right"]), int(t))
+                self.replayed += 1
+            if not self.loop:
+                return
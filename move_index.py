@@ -0,0 +1,106 @@
+import chess
+import chess.polyglot
+from collections import OrderedDict
+
+import config as cfg
+
+
+"""
+Legal moves of a position, generated once and laid out for lookups by square:
+the target squares of each source square as a bitboard, the piece type on each square
+and the targets reached by promotions (four legal moves, one per promotion piece, share each of them).
+Moves are also indexed by each of their attributes, postings are bitsets over the positions in self.moves
+so any partial description of a move is resolved by and-ing a few integers.
+"""
+class MoveIndex:
+    def __init__(self, board: chess.Board, key: int):
+        self.key = key
+        self.moves = list(board.legal_moves)
+
+        self.piece_types = [None] * 64
+        for square, piece in board.piece_map().items():
+            self.piece_types[square] = piece.piece_type
+
+        self.targets = [chess.BB_EMPTY] * 64
+        self.promotion_targets = [chess.BB_EMPTY] * 64
+        for move in self.moves:
+            self.targets[move.from_square] |= chess.BB_SQUARES[move.to_square]
+            if move.promotion is not None:
+                self.promotion_targets[move.from_square] |= chess.BB_SQUARES[move.to_square]
+
+        self.all_moves = (1 << len(self.moves)) - 1
+        self.by_src_square = [0] * 64
+        self.by_tgt_square = [0] * 64
+        self.by_src_piece = [0] * 7
+        self.by_tgt_piece = [0] * 7
+        self.by_prm_piece = [0] * 7
+        for i, move in enumerate(self.moves):
+            bit = 1 << i
+            self.by_src_square[move.from_square] |= bit
+            self.by_tgt_square[move.to_square] |= bit
+            self.by_src_piece[self.piece_types[move.from_square]] |= bit
+            if self.piece_types[move.to_square] is not None:
+                self.by_tgt_piece[self.piece_types[move.to_square]] |= bit
+            if move.promotion is not None:
+                self.by_prm_piece[move.promotion] |= bit
+
+    def is_legal(self, from_square: int, to_square: int):
+        return bool(self.targets[from_square] & chess.BB_SQUARES[to_square])
+
+    def is_promotion(self, from_square: int, to_square: int):
+        return bool(self.promotion_targets[from_square] & chess.BB_SQUARES[to_square])
+
+    def targets_of(self, from_square: int):
+        return chess.scan_forward(self.targets[from_square])
+
+    def piece_type_at(self, square: int):
+        return self.piece_types[square]
+
+    def query(self, src_square: int = None, tgt_square: int = None, src_piece: int = None, tgt_piece: int = None, prm_piece: int = None):
+        # Legal moves matching all the given attributes
+        found = self.all_moves
+        if src_square is not None:
+            found &= self.by_src_square[src_square]
+        if tgt_square is not None:
+            found &= self.by_tgt_square[tgt_square]
+        if src_piece is not None:
+            found &= self.by_src_piece[src_piece]
+        if tgt_piece is not None:
+            found &= self.by_tgt_piece[tgt_piece]
+        if prm_piece is not None:
+            found &= self.by_prm_piece[prm_piece]
+
+        moves = []
+        while found:
+            bit = found & -found
+            moves.append(self.moves[bit.bit_length() - 1])
+            found ^= bit
+        return moves
+
+
+"""
+Keeps the MoveIndex of the current position of a board, keyed by the position's Zobrist hash
+so that going back to a recent position (takeback, reset) does not generate its moves again.
+Whoever pushes, pops or resets the board has to call invalidate.
+"""
+class MoveIndexCache:
+    def __init__(self, board: chess.Board, size: int = cfg.MOVE_INDEX_CACHE_SIZE):
+        self.board = board
+        self.size = size
+        self.indices = OrderedDict()
+        self.current = None
+
+    def invalidate(self):
+        self.current = None
+
+    def get(self):
+        if self.current is None:
+            key = chess.polyglot.zobrist_hash(self.board)
+            if key in self.indices:
+                self.indices.move_to_end(key)
+            else:
+                self.indices[key] = MoveIndex(self.board, key)
+                if len(self.indices) > self.size:
+                    self.indices.popitem(last=False)
+            self.current = self.indices[key]
+        return self.current
@@ -1,10 +1,16 @@
 from typing import *
 import pygame
 import bisect
+import array
 import chess
-import io
+from timeit import default_timer as timer
 
 import config as cfg
+import asset_cache
+import animation
+import render_backend
+import text_cache
+import move_index
 import audio
 import utils
 
@@ -17,6 +23,8 @@ class Point(NamedTuple):
 """
 This class is the base class for all objects in the game.
 It has a parent-child relationship with other objects.
+Absolute positions are computed lazily: moving an object only flags its subtree,
+the position is recomputed on first read, so many moves in a row cost a single update.
 """
 class Object:
     def __init__(self, rel_pos: Point, parent=None):
@@ -28,25 +36,44 @@ class Object:
             self.parent.children.append(self)
         self.children = []
 
+        self.pos_dirty = False
         self.set_rel_pos(rel_pos)
 
     def set_rel_pos(self, rel_pos: Point):
         self.rel_pos = rel_pos
-        
-        if self.parent:
-            rel_pos = self.parent.get_abs_pos()
-            self.abs_pos = Point(rel_pos.x + self.rel_pos.x, rel_pos.y + self.rel_pos.y)
-        else:
-            self.abs_pos = self.rel_pos
+        self.moved()
 
         for child in self.children:
-            child.set_rel_pos(child.get_rel_pos())
+            child.invalidate_pos()
+
+    def invalidate_pos(self):
+        if self.pos_dirty:
+            return # Whole subtree is already flagged
+        self.moved()
+
+        for child in self.children:
+            child.invalidate_pos()
+
+    def moved(self):
+        # Subclasses extend this to react to their absolute position changing
+        self.pos_dirty = True
     
     def get_rel_pos(self):
         return self.rel_pos
     
     def get_abs_pos(self):
-        return self.abs_pos
+        if self.pos_dirty:
+            if self.parent:
+                parent_pos = self.parent.get_abs_pos()
+                self._abs_pos = Point(parent_pos.x + self.rel_pos.x, parent_pos.y + self.rel_pos.y)
+            else:
+                self._abs_pos = self.rel_pos
+            self.pos_dirty = False
+        return self._abs_pos
+
+    @property
+    def abs_pos(self):
+        return self.get_abs_pos()
     
     def __eq__(self, other):
         if not isinstance(other, Object):
@@ -67,47 +94,142 @@ Object.COUNTER = 0
 
 
 class RenderContext(NamedTuple):
-    screen: pygame.Surface
+    screen: pygame.Surface # Or anything with the same blit API
     cursor_pos: Point
+    textured: bool = False # Every image is drawn as its own texture, there is no point compositing layers
+    time: float = 0. # Timestamp of the frame (s), animations advance with it
+
+
+"""
+Attribute that marks its renderable as dirty whenever its value changes.
+"""
+class DirtyAttribute:
+    def __set_name__(self, owner, name):
+        self.name = "_" + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        if obj.__dict__.get(self.name, DirtyAttribute) != value:
+            obj.__dict__[self.name] = value
+            obj.mark_dirty()
 
 
 """
-This class represents a renderer that draws objects on the screen.
+This class represents a renderer that draws objects on the screen, through the backend picked at startup.
+In dirty rects mode only the regions changed since the last frame are redrawn and pushed to the display.
 """
 class Renderer:
-    def __init__(self, size: Point):
+    def __init__(self, size: Point, dirty_rects: bool = cfg.DIRTY_RECTS, backend: str = cfg.RENDER_BACKEND):
         self.size = size
-        self.screen = pygame.display.set_mode(size)
+        self.backend = render_backend.create_backend(backend, size)
+        self.screen = self.backend.screen
+        # Backends that swap buffers have nothing to redraw the changed regions onto
+        self.dirty_rects = dirty_rects and self.backend.keeps_frame
+        self.full_redraw = True
 
         self.renderables = []
 
     def add_renderable(self, renderable):
         bisect.insort(self.renderables, (renderable.order, renderable))
 
-    def step(self, cursor_pos: Point):
-        self.screen.fill(cfg.colors["background"])
-        render_context = RenderContext(self.screen, cursor_pos)
+    def invalidate(self):
+        self.full_redraw = True
+
+    def get_mouse_pos(self):
+        return Point(*self.backend.mouse_pos())
+
+    def step(self, cursor_pos: Point, now: float = None):
+        render_context = RenderContext(self.screen, cursor_pos, self.backend.textured, timer() if now is None else now)
 
         for _, renderable in self.renderables:
-            if renderable.is_visible:
-                renderable.draw(render_context)
+            renderable.update(render_context)
 
-        # Update the display
-        pygame.display.flip()
+        # Collect the old and new rects of whatever changed
+        rects = []
+        for _, renderable in self.renderables:
+            if renderable.dirty:
+                renderable.dirty = False
+                if renderable.drawn_rect:
+                    rects.append(renderable.drawn_rect)
+                renderable.drawn_rect = renderable.get_rect() if renderable.is_visible else None
+                if renderable.drawn_rect:
+                    rects.append(renderable.drawn_rect)
+
+        if not self.dirty_rects or self.full_redraw:
+            self.full_redraw = False
+            self.screen.fill(cfg.colors["background"])
+            for _, renderable in self.renderables:
+                if renderable.is_visible:
+                    renderable.draw(render_context)
+
+            # Update the display
+            self.backend.present()
+            return
+
+        rects = merge_rects(rects, self.screen.get_rect())
+        for rect in rects:
+            self.screen.set_clip(rect)
+            self.screen.fill(cfg.colors["background"])
+            for _, renderable in self.renderables:
+                if renderable.is_visible and renderable.drawn_rect and rect.colliderect(renderable.drawn_rect):
+                    renderable.draw(render_context)
+        self.screen.set_clip(None)
+
+        # Update only the changed regions of the display
+        self.backend.present(rects)
+
+
+def merge_rects(rects: List[pygame.Rect], bounds: pygame.Rect):
+    # Overlapping rects are merged so that no pixel is redrawn twice
+    merged = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if not rect:
+            continue
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
 
 
 """
 This class is the base class for all renderable objects in the game.
 """
 class Renderable(Object):
+    surface = DirtyAttribute()
+    is_visible = DirtyAttribute()
+
     def __init__(self, renderer: Renderer, rel_pos: Point, parent: Object=None, order=0):
         super().__init__(rel_pos, parent)
 
         self.surface = None
         self.is_visible = True
         self.order = order
+        self.dirty = True
+        self.drawn_rect = None
         renderer.add_renderable(self)
 
+    def mark_dirty(self):
+        self.dirty = True
+
+    def moved(self):
+        super().moved()
+        self.mark_dirty()
+
+    def get_rect(self):
+        if self.surface is None:
+            return None
+        return pygame.Rect(self.abs_pos, self.surface.get_size())
+
+    def update(self, context: RenderContext):
+        pass
+
     def draw(self, context: RenderContext):
         context.screen.blit(self.surface, self.abs_pos)
     
@@ -125,19 +247,41 @@ class Cursor(Renderable):
     def __init__(self, renderer: Renderer):
         super().__init__(renderer, Point(0,0), order=cfg.CURSOR_ORDER)
 
-        self.surface = pygame.Surface((cfg.cursor["size"], cfg.cursor["size"]))
-        self.mask = utils.plus_cursor_mask(cfg.cursor["size"], cfg.cursor["bottom"], cfg.cursor["top"])[:, :, None]
+        # A light plus in a dark ring, it stands out on light squares and highlights as well as on dark ones
+        core, ring = utils.outlined_cursor_mask(cfg.cursor["size"], cfg.cursor["bottom"], cfg.cursor["top"], cfg.cursor["outline"])
+        self.surface = pygame.Surface((cfg.cursor["size"], cfg.cursor["size"]), pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        alphas = pygame.surfarray.pixels_alpha(self.surface)
+        pixels[core] = pygame.Color(cfg.colors["cursor"])[:3]
+        pixels[ring] = pygame.Color(cfg.colors["cursor_outline"])[:3]
+        alphas[core | ring] = 255
+        del pixels, alphas # Unlocks the surface
+        self.surface = display_format(self.surface, alpha=True)
 
         self.holding = None
+        self.drawn_holding = None
+
+    def update(self, context: RenderContext):
+        rel_pos = Point(context.cursor_pos.x - cfg.cursor["offset"], context.cursor_pos.y - cfg.cursor["offset"])
+        if rel_pos != self.rel_pos:
+            self.set_rel_pos(rel_pos)
+        if self.holding is not self.drawn_holding:
+            self.drawn_holding = self.holding
+            self.dirty = True
+
+    def get_rect(self):
+        rect = pygame.Rect(self.abs_pos, (cfg.cursor["size"], cfg.cursor["size"]))
+        if self.holding:
+            center = Point(self.abs_pos.x + cfg.cursor["offset"], self.abs_pos.y + cfg.cursor["offset"])
+            rect = rect.union(pygame.Rect(center.x - cfg.SQUARE_SIZE//2, center.y - cfg.SQUARE_SIZE//2, cfg.SQUARE_SIZE, cfg.SQUARE_SIZE))
+        return rect
 
     def draw(self, context: RenderContext):
         if self.holding:
             self.holding.hold_draw(context)
 
-        self.set_rel_pos(Point(context.cursor_pos.x - cfg.cursor["offset"], context.cursor_pos.y - cfg.cursor["offset"]))
-
-        self.surface.blit(context.screen, (0, 0), (*self.abs_pos, cfg.cursor["size"], cfg.cursor["size"]))
-        context.screen.blit(pygame.surfarray.make_surface(self.mask + pygame.surfarray.array3d(self.surface)), self.abs_pos)
+        context.screen.blit(self.surface, self.abs_pos)
 
     def release(self):
         if self.holding:
@@ -147,28 +291,61 @@ class Cursor(Renderable):
 
 """
 This class is responsible for colliding clicks to objects.
+Visible clickables are indexed in a uniform grid, so a lookup only looks at the few clickables sharing the cursor's cell.
 """
 class Clicker:
-    def __init__(self, renderer: Renderer):
+    def __init__(self, renderer: Renderer, cell_size: int = cfg.CLICKER_CELL_SIZE):
         self.clickables = []
         self.curr_clickable = None
         self.cursor = Cursor(renderer)
 
+        self.cell_size = cell_size
+        self.grid = {}
+        self.clickable_cells = {}
+        self.stale = {}
+
     def add_clickable(self, clickable):
         bisect.insort(self.clickables, (clickable.order, clickable))
+        self.mark_stale(clickable)
 
-    def highlight(self, cursor_pos: Point):
-        # Should be done with a quadtree (?) Naaaaah, it's O(n)
+    def mark_stale(self, clickable):
+        # Called whenever a clickable moves or changes visibility, the grid catches up on the next lookup
+        self.stale[clickable.id] = clickable
+
+    def update_clickable(self, clickable):
+        for cell in self.clickable_cells.pop(clickable.id, ()):
+            self.grid[cell].remove(clickable)
+
+        if not clickable.is_visible:
+            return
+
+        left, top = clickable.abs_pos.x, clickable.abs_pos.y
+        right, bottom = left + clickable.rect.x, top + clickable.rect.y
+
+        cells = [(cx, cy) for cx in range(int(left // self.cell_size), int(right // self.cell_size) + 1)
+                          for cy in range(int(top // self.cell_size), int(bottom // self.cell_size) + 1)]
+        for cell in cells:
+            self.grid.setdefault(cell, []).append(clickable)
+        self.clickable_cells[clickable.id] = cells
+
+    def find(self, cursor_pos: Point):
+        for clickable in self.stale.values():
+            self.update_clickable(clickable)
+        self.stale.clear()
+
+        # The topmost clickable wins, same as scanning the sorted clickables backwards
         found = None
-        for _, clickable in self.clickables[::-1]:
-            if not clickable.is_visible:
-                continue
+        for clickable in self.grid.get((cursor_pos.x // self.cell_size, cursor_pos.y // self.cell_size), ()):
             left, top = clickable.abs_pos.x, clickable.abs_pos.y
             right, bottom = left + clickable.rect.x, top + clickable.rect.y
 
             if left < cursor_pos.x <= right and top < cursor_pos.y <= bottom:
-                found = clickable
-                break
+                if found is None or (clickable.order, clickable) > (found.order, found):
+                    found = clickable
+        return found
+
+    def highlight(self, cursor_pos: Point):
+        found = self.find(cursor_pos)
         
         if not found is None:
             if found != self.curr_clickable:
@@ -196,13 +373,33 @@ class Clicker:
 This class is the base class for all clickable objects in the game.
 """
 class Clickable(Renderable):
+    is_highlighted = DirtyAttribute()
+    clicker = None
+
     def __init__(self, renderer: Renderer, clicker: Clicker, rel_pos: Point, rect: Point, order=0, parent: Object=None):
         super().__init__(renderer, rel_pos, parent, order)
         self.rect = rect
         self.is_highlighted = False
 
+        self.clicker = clicker
         clicker.add_clickable(self)
 
+    def moved(self):
+        super().moved()
+        if self.clicker:
+            self.clicker.mark_stale(self)
+
+    def set_visible(self):
+        super().set_visible()
+        self.clicker.mark_stale(self)
+
+    def set_invisible(self):
+        super().set_invisible()
+        self.clicker.mark_stale(self)
+
+    def get_rect(self):
+        return pygame.Rect(self.abs_pos, self.rect)
+
     def enable_highlight(self):
         self.is_highlighted = True
 
@@ -232,15 +429,39 @@ PIECE_IMAGES = None
 BOARD_IMAGE = None
 PROMOTION_BUBBLE_IMAGE = None
 
-SQUARE_SURFACE = None
+GHOST_IMAGES = None
+OVERLAY_SURFACES = None
+
+def display_format(surface: pygame.Surface, alpha: bool = False):
+    # The texture backend has no display surface to convert to, it makes its textures from the surfaces as they are
+    if pygame.display.get_surface() is None:
+        return surface.copy()
+    return surface.convert_alpha() if alpha else surface.convert()
 
 def load_consts():
-    global PIECE_IMAGES, BOARD_IMAGE, PROMOTION_BUBBLE_IMAGE, SQUARE_SURFACE
-    PIECE_IMAGES = [None] + [pygame.image.load(io.BytesIO(utils.make_svg_piece(side + name, cfg.SQUARE_SIZE).encode())).convert_alpha() for side in "bw" for name in NOTATION.values()]
-    BOARD_IMAGE = pygame.image.load(io.BytesIO(utils.make_svg_board(cfg.SQUARE_SIZE).encode())).convert()
-    PROMOTION_BUBBLE_IMAGE = pygame.image.load(io.BytesIO(utils.make_svg_promotion(cfg.SQUARE_SIZE).encode())).convert_alpha()
-    SQUARE_SURFACE = pygame.Surface((cfg.SQUARE_SIZE, cfg.SQUARE_SIZE)).convert_alpha()
-    SQUARE_SURFACE.set_alpha(cfg.SQUARES_ALPHA)
+    global PIECE_IMAGES, BOARD_IMAGE, PROMOTION_BUBBLE_IMAGE, GHOST_IMAGES, OVERLAY_SURFACES
+    pieces = [side + name for side in "bw" for name in NOTATION.values()]
+    svgs = {piece: utils.make_svg_piece(piece, cfg.SQUARE_SIZE).encode() for piece in pieces}
+    svgs["board"] = utils.make_svg_board(cfg.SQUARE_SIZE).encode()
+    svgs["promotion"] = utils.make_svg_promotion(cfg.SQUARE_SIZE).encode()
+
+    images = asset_cache.load_svgs(svgs, lambda name, image: display_format(image, alpha=name != "board"))
+
+    PIECE_IMAGES = [None] + [images[piece] for piece in pieces]
+    BOARD_IMAGE = images["board"]
+    PROMOTION_BUBBLE_IMAGE = images["promotion"]
+
+    # Pieces left behind while being dragged
+    GHOST_IMAGES = [None] + [image.copy() for image in PIECE_IMAGES[1:]]
+    for image in GHOST_IMAGES[1:]:
+        image.set_alpha(cfg.SQUARES_ALPHA)
+
+    # Square overlays, one per highlight and draw_state
+    OVERLAY_SURFACES = {}
+    for state in ["highlight", "selected", "moveable", "danger", "promotion_highlight"]:
+        OVERLAY_SURFACES[state] = display_format(pygame.Surface((cfg.SQUARE_SIZE, cfg.SQUARE_SIZE)), alpha=True)
+        OVERLAY_SURFACES[state].set_alpha(cfg.SQUARES_ALPHA)
+        OVERLAY_SURFACES[state].fill(cfg.colors[state])
 
 pygame.font.init()
 
@@ -248,8 +469,54 @@ def get_piece_code(piece_type: chess.PieceType, color: chess.Color):
     return color * 6 + piece_type
 
 
+"""
+View model of the 64 squares, the state GUISquares expose is stored here in flat arrays indexed by square code.
+"""
+class BoardView:
+    __slots__ = ("piece_codes", "draw_states", "highlighted", "held", "hidden", "stale", "stale_squares")
+
+    def __init__(self):
+        self.piece_codes = array.array("B", bytes(64))
+        self.draw_states = [None] * 64
+        self.highlighted = array.array("B", bytes(64))
+        self.held = array.array("B", bytes(64))
+        self.hidden = array.array("B", bytes(64)) # Piece is on its way there, drawn by a sprite
+
+        # Squares to composite again into the board layer
+        self.stale = bytearray(64)
+        self.stale_squares = []
+
+    def invalidate(self, square_code: int):
+        if not self.stale[square_code]:
+            self.stale[square_code] = 1
+            self.stale_squares.append(square_code)
+
+
+"""
+Attribute of a GUISquare stored in its board's view model, changing it marks the square dirty.
+"""
+class ViewAttribute:
+    def __init__(self, array_name: str):
+        self.array_name = array_name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj.parent.view, self.array_name)[obj.square_code]
+
+    def __set__(self, obj, value):
+        values = getattr(obj.parent.view, self.array_name)
+        if values[obj.square_code] != value:
+            values[obj.square_code] = value
+            obj.mark_dirty()
+
+
 """
 This class represents the board.
+Board, overlays and pieces are composited into a layer that is drawn with a single blit,
+squares are composited again, all in one Surface.blits call, only when their state changes.
+With a textured backend the layer is skipped and every square is drawn from its textures each frame.
+Moves that are not dropped by hand glide to their squares on sprites, only the sprites' rects are redrawn meanwhile.
 """
 class Board(Renderable):
     def __init__(self, renderer: Renderer, clicker: Clicker, rel_pos: Point, starting_fen: str=None):
@@ -257,6 +524,11 @@ class Board(Renderable):
         
         self.currently_selected = None
         self.last_move = None
+        self.marked_squares = []
+        self.piece_changes = []
+        self.view = BoardView()
+        self.square_rects = [pygame.Rect(chess.square_file(square_code) * cfg.SQUARE_SIZE, (7 - chess.square_rank(square_code)) * cfg.SQUARE_SIZE, cfg.SQUARE_SIZE, cfg.SQUARE_SIZE)
+                             for square_code in chess.SQUARES]
 
         self.gui_squares = [None] * 64
         for file in range(8):
@@ -268,6 +540,7 @@ class Board(Renderable):
             self.board = chess.Board(starting_fen)
         else:
             self.board = chess.Board()
+        self.move_index = move_index.MoveIndexCache(self.board)
             
             
         # Instatiate Promotion Bubble 
@@ -276,6 +549,9 @@ class Board(Renderable):
 
         self.game_end_text = FloatingText(renderer, Point(10, cfg.SQUARE_SIZE*3), "GAME OVER", 100, cfg.colors["redtext"], background=None, parent=self)
 
+        # Enough for a capture (captured piece below the moving one) or a castling (king and rook)
+        self.sprites = [PieceSprite(renderer, self) for _ in range(3)]
+
         self.update_board()
 
         # Create board surface
@@ -284,61 +560,173 @@ class Board(Renderable):
         self.surface.blit(BOARD_IMAGE, (0, 0))
         
         # Add rank and file labels
-        font = pygame.font.Font(cfg.BOARD_TEXT_FONT, cfg.BOARD_TEXT_SIZE)
         for i in range(8):
-            size = font.size("87654321"[i])
-            text = font.render("87654321"[i], cfg.TEXT_ANTIALIAS, cfg.colors["boardtext"], cfg.colors["background"])
-            self.surface.blit(text, (cfg.SQUARE_SIZE * 8 + cfg.BOARD_TEXT_H_DISTANCE, int(cfg.SQUARE_SIZE * (i + .5)) - size[1]//2))
+            text = text_cache.render(cfg.BOARD_TEXT_FONT, cfg.BOARD_TEXT_SIZE, "87654321"[i], cfg.colors["boardtext"], cfg.colors["background"])
+            self.surface.blit(text, (cfg.SQUARE_SIZE * 8 + cfg.BOARD_TEXT_H_DISTANCE, int(cfg.SQUARE_SIZE * (i + .5)) - text.get_height()//2))
+
+            text = text_cache.render(cfg.BOARD_TEXT_FONT, cfg.BOARD_TEXT_SIZE, "abcdefgh"[i], cfg.colors["boardtext"], cfg.colors["background"])
+            self.surface.blit(text, (int(cfg.SQUARE_SIZE * (i + .5)) - text.get_width()//2, cfg.SQUARE_SIZE * 8 + cfg.BOARD_TEXT_V_DISTANCE))
+
+        self.layer = self.surface.copy()
+
+    def update(self, context: RenderContext):
+        # Sprites are advanced first, so a piece landing on its square is composited in the same frame
+        for sprite in self.sprites:
+            sprite.advance(context.time)
 
-            size = font.size("abcdefgh"[i])
-            text = font.render("abcdefgh"[i], cfg.TEXT_ANTIALIAS, cfg.colors["boardtext"], cfg.colors["background"])
-            self.surface.blit(text, (int(cfg.SQUARE_SIZE * (i + .5)) - size[0]//2, cfg.SQUARE_SIZE * 8 + cfg.BOARD_TEXT_V_DISTANCE))
+        view = self.view
+        if not view.stale_squares:
+            return
+
+        blits = []
+        for square_code in view.stale_squares:
+            view.stale[square_code] = 0
+            if not context.textured:
+                rect = self.square_rects[square_code]
+                blits.append((self.surface, rect, rect))
+                self.square_blits(square_code, rect, blits)
+        view.stale_squares.clear()
+
+        self.layer.blits(blits, doreturn=False)
+
+    def square_blits(self, square_code: int, rect: pygame.Rect, blits: list):
+        view = self.view
+        if view.highlighted[square_code]:
+            blits.append((OVERLAY_SURFACES["highlight"], rect))
+
+        if view.draw_states[square_code]:
+            blits.append((OVERLAY_SURFACES[view.draw_states[square_code]], rect))
+
+        piece_code = view.piece_codes[square_code]
+        if piece_code != 0 and not view.hidden[square_code]:
+            blits.append(((GHOST_IMAGES if view.held[square_code] else PIECE_IMAGES)[piece_code], rect))
+
+    def draw(self, context: RenderContext):
+        if not context.textured:
+            context.screen.blit(self.layer, self.abs_pos)
+            return
+
+        blits = [(self.surface, self.abs_pos)]
+        for square_code in chess.SQUARES:
+            self.square_blits(square_code, self.square_rects[square_code].move(self.abs_pos), blits)
+        context.screen.blits(blits, doreturn=False)
 
     def takeback(self):
+        self.finish_animations()
+        squares = []
         try:
-            self.board.pop()
+            # After a pop the board is back to the position the move was played from
+            squares += self.move_squares(self.board.pop())
             if self.board.turn == chess.BLACK:
-                self.board.pop()
+                squares += self.move_squares(self.board.pop())
         except IndexError:
             pass # WHO?! WHO DARES TO TAKEBACK WHEN THERE IS NO MOVE TO TAKEBACK?!
+        self.move_index.invalidate()
         self.deselect_square()
-        self.update_board()
-
-    def update_board(self):
+        self.update_board(squares)
+
+    def move_squares(self, move: chess.Move):
+        # Squares whose piece changes when move is played from the current position
+        squares = [move.from_square, move.to_square]
+        if self.board.is_castling(move):
+            rank = chess.square_rank(move.from_square)
+            if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+                squares += [chess.square(7, rank), chess.square(5, rank)]
+            else:
+                squares += [chess.square(0, rank), chess.square(3, rank)]
+        elif self.board.is_en_passant(move):
+            squares.append(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+        return squares
+
+    def update_board(self, squares: List[int] = None):
+        # Refreshes the pieces on the given squares (all of them if None). The change list, (square_code, piece_code)
+        # of the squares whose piece changed, is kept in piece_changes and returned, only those squares are redrawn
         self.game_end_text.set_invisible()
-        for square in self.gui_squares:
-            if piece := self.board.piece_at(square.square_code):
-                square.piece_code = get_piece_code(piece.piece_type, piece.color)
+        piece_codes = self.view.piece_codes
+        self.piece_changes = []
+        for square_code in (chess.SQUARES if squares is None else squares):
+            if piece := self.board.piece_at(square_code):
+                piece_code = get_piece_code(piece.piece_type, piece.color)
             else:
-                square.piece_code = 0
+                piece_code = 0
+            if piece_codes[square_code] != piece_code:
+                piece_codes[square_code] = piece_code
+                self.gui_squares[square_code].mark_dirty()
+                self.piece_changes.append((square_code, piece_code))
 
         if self.board.is_check():
-            self.get_square(self.board.king(self.board.turn)).draw_state = "danger"
+            self.mark_square(self.board.king(self.board.turn), "danger")
         self.last_move = None
 
+        if cfg.VERIFY_BOARD_UPDATES and squares is not None:
+            self.verify_board()
+        return self.piece_changes
+
+    def verify_board(self):
+        # Checks the incrementally updated squares against a full rebuild
+        for square in self.gui_squares:
+            piece = self.board.piece_at(square.square_code)
+            expected = get_piece_code(piece.piece_type, piece.color) if piece else 0
+            assert square.piece_code == expected, f"{chess.square_name(square.square_code)} shows {square.piece_code} instead of {expected}"
+            assert square.draw_state is None or square.square_code in self.marked_squares, f"{chess.square_name(square.square_code)} is marked but not tracked"
+
+    def mark_square(self, square_code: int, draw_state: str):
+        self.get_square(square_code).draw_state = draw_state
+        self.marked_squares.append(square_code)
+
     def get_square(self, square_code: int):
         return self.gui_squares[square_code]
 
+    def move_animations(self, move: chess.Move):
+        # (piece_code, from_square, to_square) of the pieces moved by move from the current position, captured piece first
+        squares = self.move_squares(move)
+        piece = self.board.piece_at(move.from_square)
+        animations = [(get_piece_code(piece.piece_type, piece.color), move.from_square, move.to_square)]
+
+        if self.board.is_castling(move):
+            animations.append((get_piece_code(chess.ROOK, piece.color), squares[2], squares[3]))
+        else:
+            captured_square = squares[2] if self.board.is_en_passant(move) else move.to_square
+            if captured := self.board.piece_at(captured_square):
+                animations.insert(0, (get_piece_code(captured.piece_type, captured.color), captured_square, captured_square))
+        return animations
+
+    def play_animations(self, animations: list):
+        for sprite, (piece_code, from_square, to_square) in zip(self.sprites, animations):
+            on_done = None
+            if from_square != to_square:
+                self.gui_squares[to_square].hidden = True
+                on_done = self.gui_squares[to_square].land
+            sprite.play(PIECE_IMAGES[piece_code], self.square_rects[from_square].topleft, self.square_rects[to_square].topleft, cfg.MOVE_ANIMATION_MS / 1000, on_done)
+
+    def finish_animations(self):
+        for sprite in self.sprites:
+            sprite.finish()
+
+    def is_animating(self):
+        return any(sprite.tween for sprite in self.sprites)
+
     def square_clicked(self, square_code: int, clicking_color: bool = chess.WHITE, promotion: int = None, can_select=True):
         if clicking_color != self.board.turn:
             return
+        self.finish_animations()
 
         if self.currently_selected is None:
             if can_select:
                 self.select_square(square_code)
         else:
-            is_legal = any(move.from_square == self.currently_selected and move.to_square == square_code
-                           for move in self.board.legal_moves)
+            moves = self.move_index.get()
 
-            if is_legal:
-                if self.board.piece_at(self.currently_selected).piece_type == chess.PAWN and (chess.square_rank(square_code) == 0 or chess.square_rank(square_code) == 7):
+            if moves.is_legal(self.currently_selected, square_code):
+                if moves.is_promotion(self.currently_selected, square_code):
                     if promotion is None:
                         # Show promotion bubble
                         self.promotion.setup(square_code, clicking_color)
                     else:
                         self.move_piece(square_code, promotion)
                 else: 
-                    self.move_piece(square_code)
+                    # A piece released on its square by hand (can_select is False) is already there
+                    self.move_piece(square_code, animate=can_select)
             else:                    
                 if self.currently_selected != square_code:
                     self.deselect_square()
@@ -357,38 +745,44 @@ class Board(Renderable):
         gui_square = self.get_square(square_code)
         if gui_square.piece_code == 0 or (gui_square.piece_code > 6) != self.board.turn:
             return
-        gui_square.draw_state = "selected"
+        self.mark_square(square_code, "selected")
         self.currently_selected = square_code
 
-        for move in self.board.legal_moves:
-            if move.from_square == square_code:
-                self.get_square(move.to_square).draw_state = "moveable"
+        moves = self.move_index.get()
+        for to_square in moves.targets_of(square_code):
+            self.mark_square(to_square, "moveable")
 
-                # Castling highlight
-                if self.board.piece_at(square_code).piece_type == chess.KING:
-                    match move.to_square:
-                        case chess.G1: self.get_square(chess.F1).draw_state = "moveable"
-                        case chess.C1: self.get_square(chess.D1).draw_state = "moveable"
-                        case chess.G8: self.get_square(chess.F8).draw_state = "moveable"
-                        case chess.C8: self.get_square(chess.D8).draw_state = "moveable"
+            # Castling highlight
+            if moves.piece_type_at(square_code) == chess.KING:
+                match to_square:
+                    case chess.G1: self.mark_square(chess.F1, "moveable")
+                    case chess.C1: self.mark_square(chess.D1, "moveable")
+                    case chess.G8: self.mark_square(chess.F8, "moveable")
+                    case chess.C8: self.mark_square(chess.D8, "moveable")
 
     def deselect_square(self):
         self.promotion.set_invisible()
 
-        for square in self.gui_squares:
-            square.draw_state = None
+        # Only the squares marked since the last deselection have a draw_state to clear
+        for square_code in self.marked_squares:
+            self.get_square(square_code).draw_state = None
+        self.marked_squares.clear()
 
         # Check if the king is in check
         if self.board.is_check():
-            self.get_square(self.board.king(self.board.turn)).draw_state = "danger"
+            self.mark_square(self.board.king(self.board.turn), "danger")
 
         self.currently_selected = None
 
-    def move_piece(self, square_code: int, promotion : int = None):
+    def move_piece(self, square_code: int, promotion : int = None, animate: bool = True):
 
         last_move = (chess.piece_name(self.board.piece_at(self.currently_selected).piece_type), chess.square_name(self.currently_selected), chess.square_name(square_code), chess.piece_name(promotion) if promotion is not None else None)
         
-        self.board.push(chess.Move(self.currently_selected, square_code, promotion))
+        move = chess.Move(self.currently_selected, square_code, promotion)
+        squares = self.move_squares(move)
+        animations = self.move_animations(move) if animate and cfg.MOVE_ANIMATION_MS > 0 else []
+        self.board.push(move)
+        self.move_index.invalidate()
 
         if self.board.is_check():
             audio.CHECK_SOUND.set_volume(cfg.KING_CHECK_VOLUME)
@@ -399,7 +793,8 @@ class Board(Renderable):
             audio.MOVE_SOUND.play(loops=0, maxtime=0, fade_ms=0)
 
         self.deselect_square()
-        self.update_board()
+        self.update_board(squares)
+        self.play_animations(animations)
 
         if self.board.is_game_over():
             pygame.event.post(pygame.event.Event(utils.GAME_ENDED))
@@ -411,7 +806,9 @@ class Board(Renderable):
 
 
     def reset(self):
+        self.finish_animations()
         self.board.reset()
+        self.move_index.invalidate()
 
         self.deselect_square()
         self.update_board()
@@ -421,31 +818,31 @@ class Board(Renderable):
 This class represents a square on the board.
 """
 class GUISquare(Clickable):
+    draw_state = ViewAttribute("draw_states")
+    piece_code = ViewAttribute("piece_codes")
+    held = ViewAttribute("held")
+    hidden = ViewAttribute("hidden")
+    is_highlighted = ViewAttribute("highlighted")
+
     def __init__(self, renderer: Renderer, clicker: Clicker, rel_pos: Point, board_parent: Board, square_code: int, piece_code: int=0):
+        # The state lives in the board's view, so the square needs to know where it is before anything else
+        self.square_code = square_code
         super().__init__(renderer, clicker, rel_pos, Point(cfg.SQUARE_SIZE, cfg.SQUARE_SIZE), cfg.GUISQUARE_ORDER, board_parent)
         self.draw_state = None
 
-        self.square_code = square_code
         self.piece_code = piece_code
         self.held = False
+        self.hidden = False
+
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.parent.view.invalidate(self.square_code)
 
     def draw(self, context: RenderContext):
-        if self.is_highlighted:
-            SQUARE_SURFACE.fill(cfg.colors["highlight"])
-            context.screen.blit(SQUARE_SURFACE, self.abs_pos)
+        pass # Composited into the board layer
 
-        if self.draw_state:
-            SQUARE_SURFACE.fill(cfg.colors[self.draw_state])
-            context.screen.blit(SQUARE_SURFACE, self.abs_pos)
-        
-        if self.piece_code != 0:
-            if self.held:
-                # Draw in place
-                PIECE_IMAGES[self.piece_code].set_alpha(cfg.SQUARES_ALPHA)
-                context.screen.blit(PIECE_IMAGES[self.piece_code], self.abs_pos)
-                PIECE_IMAGES[self.piece_code].set_alpha(255)
-            else:
-                context.screen.blit(PIECE_IMAGES[self.piece_code], self.abs_pos)
+    def land(self):
+        self.hidden = False
 
     def _click(self, can_select=True):
         self.parent.square_clicked(self.square_code, chess.WHITE, can_select=can_select)
@@ -464,18 +861,60 @@ class GUISquare(Clickable):
         context.screen.blit(PIECE_IMAGES[self.piece_code], Point(context.cursor_pos.x - cfg.SQUARE_SIZE//2, context.cursor_pos.y - cfg.SQUARE_SIZE//2))
 
 
+"""
+This class represents a piece gliding between two squares of the board, drawn above it.
+The board advances it with the frame timestamps and owns the squares it lands on.
+"""
+class PieceSprite(Renderable):
+    def __init__(self, renderer: Renderer, board_parent: Board):
+        super().__init__(renderer, Point(0, 0), board_parent, cfg.PIECE_SPRITE_ORDER)
+        self.tween = None
+        self.on_done = None
+        self.set_invisible()
+
+    def play(self, image: pygame.Surface, from_pos: Point, to_pos: Point, duration: float, on_done: Callable = None):
+        self.finish()
+        self.surface = image
+        self.tween = animation.Tween(from_pos, to_pos, duration)
+        self.on_done = on_done
+        self.set_rel_pos(Point(*from_pos))
+        self.set_visible()
+
+    def advance(self, now: float):
+        if self.tween is None:
+            return
+        if self.tween.progress(now) >= 1:
+            self.finish()
+            return
+        x, y = self.tween.value(now)
+        pos = Point(round(x), round(y))
+        if pos != self.rel_pos:
+            self.set_rel_pos(pos)
+
+    def finish(self):
+        if self.tween is None:
+            return
+        self.tween = None
+        self.set_invisible()
+        on_done, self.on_done = self.on_done, None
+        if on_done:
+            on_done()
+
+
 class FloatingText(Renderable):
     def __init__(self, renderer: Renderer, rel_pos: Point, text: str, font_size: int, color: Tuple[int, int, int], font: str = cfg.BOARD_TEXT_FONT, background=cfg.colors["background"], parent: Object=None, order=3):
         super().__init__(renderer, rel_pos, parent, order)
 
-        self.font = pygame.font.Font(font, font_size)
+        self.font = font
+        self.font_size = font_size
         self.background = background
         self.set_text(text, color)
 
     def set_text(self, text: str, color: Tuple[int, int, int] = None):
         if color:
             self.curr_color = color
-        self.surface = self.font.render(text, cfg.TEXT_ANTIALIAS, self.curr_color, self.background)
+        # Same text as before gives back the same surface, which does not dirty anything
+        self.surface = text_cache.render(self.font, self.font_size, text, self.curr_color, self.background)
 
 
 # Class to test that the promotion bubble i did is of correct size, <3, gne 
@@ -483,6 +922,7 @@ class PromotionBubble(Renderable):
     def __init__(self, renderer: Renderer, clicker: Clicker, rel_pos: Point, board_parent: Board):
         super().__init__(renderer, rel_pos, board_parent, cfg.PROMOTION_BUBBLE_ORDER)
         self.surface = PROMOTION_BUBBLE_IMAGE 
+        self.mirrored_surface = pygame.transform.flip(PROMOTION_BUBBLE_IMAGE, True, False)
         self.mirror = False
         self.square_code = None
         self.color = None
@@ -516,7 +956,7 @@ class PromotionBubble(Renderable):
     
     def draw(self, context: RenderContext):
         if self.mirror:
-            context.screen.blit(pygame.transform.flip(self.surface, True, False), self.abs_pos)
+            context.screen.blit(self.mirrored_surface, self.abs_pos)
         else:
             context.screen.blit(self.surface, self.abs_pos) 
     
@@ -532,8 +972,7 @@ class PromotionButton(Clickable):
 
     def draw(self, context: RenderContext):
         if self.is_highlighted:
-            SQUARE_SURFACE.fill(cfg.colors["promotion_highlight"])
-            context.screen.blit(SQUARE_SURFACE, self.abs_pos)
+            context.screen.blit(OVERLAY_SURFACES["promotion_highlight"], self.abs_pos)
         
         if self.piece_code != 0:
             context.screen.blit(PIECE_IMAGES[get_piece_code(self.piece_code, self.parent.color)], self.abs_pos)
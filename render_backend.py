@@ -0,0 +1,122 @@
+import pygame
+import weakref
+
+try:
+    from pygame._sdl2 import video
+except ImportError:
+    video = None
+
+import config as cfg
+
+
+"""
+Software backend, renderables blit straight onto the display surface.
+Keeps the previous frame around, so the renderer can redraw only what changed.
+"""
+class SoftwareBackend:
+    textured = False
+    keeps_frame = True
+
+    def __init__(self, size):
+        self.screen = pygame.display.set_mode(size)
+
+    def present(self, rects=None):
+        if rects is None:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+
+    def mouse_pos(self):
+        return pygame.mouse.get_pos()
+
+
+"""
+Draw target with the blit API of a pygame.Surface, drawing through an SDL2 renderer.
+Every surface is uploaded once as a texture, the texture lives as long as the surface does.
+"""
+class TextureTarget:
+    def __init__(self, renderer, size):
+        self.renderer = renderer
+        self.size = size
+        self.textures = weakref.WeakKeyDictionary()
+
+    def get_size(self):
+        return self.size
+
+    def get_rect(self):
+        return pygame.Rect((0, 0), self.size)
+
+    def texture(self, surface: pygame.Surface):
+        texture = self.textures.get(surface)
+        if texture is None:
+            texture = video.Texture.from_surface(self.renderer, surface)
+            if surface.get_flags() & pygame.SRCALPHA or surface.get_alpha() is not None:
+                texture.blend_mode = pygame.BLENDMODE_BLEND
+                if surface.get_alpha() is not None:
+                    texture.alpha = surface.get_alpha()
+            self.textures[surface] = texture
+        return texture
+
+    def blit(self, source: pygame.Surface, dest, area=None):
+        texture = self.texture(source)
+        x, y = dest[0], dest[1]
+        if area is None:
+            texture.draw(dstrect=(x, y, texture.width, texture.height))
+        else:
+            area = pygame.Rect(area)
+            texture.draw(srcrect=area, dstrect=(x, y, area.width, area.height))
+
+    def blits(self, blit_sequence, doreturn=True):
+        for blit in blit_sequence:
+            self.blit(*blit)
+
+    def fill(self, color, rect=None):
+        self.renderer.draw_color = pygame.Color(color)
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+
+
+"""
+Texture backend on pygame's SDL2 renderer, the scene is drawn at its logical size and scaled to the window by SDL.
+On machines without a GPU SDL picks its own software renderer.
+Buffers are swapped on present, so every frame is drawn whole.
+"""
+class TextureBackend:
+    textured = True
+    keeps_frame = False
+
+    def __init__(self, size, window_size=None):
+        self.window = video.Window("Chess", size=window_size or size, resizable=True)
+        self.renderer = video.Renderer(self.window, accelerated=-1)
+        self.renderer.logical_size = size
+        self.screen = TextureTarget(self.renderer, size)
+
+    def present(self, rects=None):
+        self.renderer.present()
+
+    def mouse_pos(self):
+        # Mouse state is in window pixels, the scene is in logical ones
+        x, y = pygame.mouse.get_pos()
+        viewport = self.renderer.get_viewport()
+        scale_x, scale_y = self.renderer.scale
+        return int(x / scale_x) - viewport.x, int(y / scale_y) - viewport.y
+
+
+BACKENDS = dict(
+    software = SoftwareBackend,
+    texture = TextureBackend,
+)
+
+def create_backend(name: str, size):
+    if name == "texture":
+        try:
+            if video is None:
+                raise pygame.error("pygame._sdl2 is not available")
+            return TextureBackend(size, cfg.WINDOW_SIZE)
+        except pygame.error as e:
+            print("Texture backend not available, falling back to software:", e)
+    elif name not in BACKENDS:
+        raise ValueError(f"Unknown render backend {name}, expected one of {', '.join(BACKENDS)}")
+    return SoftwareBackend(size)
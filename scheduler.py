@@ -0,0 +1,84 @@
+import pygame
+from collections import deque
+from timeit import default_timer as timer
+import numpy as np
+
+import config as cfg
+import utils
+
+
+"""
+This class paces the main loop.
+While something is going on it runs at the target frame rate, waiting out whatever is left of each frame.
+When nothing happened for a while it goes idle and polls the event queue until input,
+a modality thread (through wake) or a timeout wakes it up.
+"""
+class FrameScheduler:
+    def __init__(self, target_fps=cfg.TARGET_FPS, idle_after_ms=cfg.IDLE_AFTER_MS, idle_timeout_ms=cfg.IDLE_TIMEOUT_MS, idle_poll_ms=cfg.IDLE_POLL_MS, stats_window=cfg.FRAME_STATS_WINDOW):
+        self.frame_time = 1 / target_fps
+        self.idle_after = idle_after_ms / 1000
+        self.idle_timeout = idle_timeout_ms / 1000
+        self.idle_poll_ms = idle_poll_ms
+
+        self.frame_start = timer()
+        self.deadline = self.frame_start + self.frame_time
+        self.last_activity = self.frame_start
+        self.is_idle = False
+
+        self.frame_times = deque(maxlen=stats_window)
+        self.work_times = deque(maxlen=stats_window)
+        self.frames = 0
+        self.idle_frames = 0
+
+    def wake(self):
+        # Can be called from any thread, it unblocks an idle wait
+        pygame.event.post(pygame.event.Event(utils.WAKE_UP))
+
+    def mark_active(self):
+        self.last_activity = timer()
+
+    def begin_frame(self):
+        now = timer()
+        if self.frames > 0:
+            self.frame_times.append(now - self.frame_start)
+        self.frame_start = now
+        self.frames += 1
+
+    def end_frame(self):
+        now = timer()
+        self.work_times.append(now - self.frame_start)
+
+        self.is_idle = now - self.last_activity > self.idle_after
+        if self.is_idle:
+            self.idle_frames += 1
+            # Peeking leaves events where they are, taking one out and posting it back would put it behind later ones
+            timeout = now + self.idle_timeout
+            while timer() < timeout:
+                if pygame.event.peek():
+                    self.mark_active()
+                    break
+                pygame.time.wait(self.idle_poll_ms)
+            self.deadline = timer() + self.frame_time
+            return
+
+        self.deadline += self.frame_time
+        if now >= self.deadline:
+            # Fell behind, start pacing again from here instead of rushing frames to catch up
+            self.deadline = now
+        else:
+            pygame.time.wait(int((self.deadline - now) * 1000))
+
+    def stats(self):
+        frame_times = np.array(self.frame_times) * 1000
+        work_times = np.array(self.work_times) * 1000
+        if len(frame_times) == 0:
+            return None
+        return dict(
+            frames = self.frames,
+            idle_frames = self.idle_frames,
+            fps = float(1000 / frame_times.mean()),
+            frame_ms_p50 = float(np.percentile(frame_times, 50)),
+            frame_ms_p99 = float(np.percentile(frame_times, 99)),
+            work_ms_p50 = float(np.percentile(work_times, 50)),
+            work_ms_p99 = float(np.percentile(work_times, 99)),
+        )
@@ -8,8 +8,9 @@ from timeit import default_timer as timer
 import config as cfg 
 
 class SpeechManager():
-    def __init__(self, board : objects.Board):
+    def __init__(self, board : objects.Board, on_command=None):
         self.board = board 
+        self.on_command = on_command
         self.t = Thread(target=self.run, args=())
         self.t.daemon = True
         self.commands = deque() 
@@ -17,6 +18,8 @@ class SpeechManager():
     def push_command(self,command):
         timestamp = int(timer() * 1000)     # Current Time Frame -> each time we execute a command, we get the time 
         self.commands.append((command, timestamp))
+        if self.on_command:
+            self.on_command()
 
     def run(self):
         
@@ -51,8 +54,12 @@ class SpeechManager():
         
         
     def resolve_commands(self, curr_time):
-        legal_moves = self.board.board.legal_moves
+        # Goes through the queued commands in one pass, each one is resolved against the move index of the current position.
+        # Returns the first command that matches a single move, whether any command was heard
+        # and how many of the commands gone through matched several moves
+        move_index = self.board.move_index.get()
         some_command = False
+        ambiguous = 0
         
         while len(self.commands) > 0:
             command, timestamp = self.commands.popleft() 
@@ -90,28 +97,21 @@ class SpeechManager():
                         tgt_square = chess.C8
             
             elif verb == "promote":
-                return (None, None, prm_piece), some_command
+                return (None, None, prm_piece), some_command, ambiguous
             
+            # Intersect the postings of the given details
+            moves = move_index.query(src_square, tgt_square, src_piece, tgt_piece, prm_piece)
 
-            # Execute generator of legal moves
-            moves = list(legal_moves)
-
-            # Filter moves based on the given details
-            if src_square is not None:
-                moves = [move for move in moves if move.from_square == src_square]
-            if tgt_square is not None:
-                moves = [move for move in moves if move.to_square == tgt_square]
-            if src_piece is not None:
-                moves = [move for move in moves if self.board.board.piece_at(move.from_square) is not None and self.board.board.piece_at(move.from_square).piece_type == src_piece]
-            if tgt_piece is not None:
-                moves = [move for move in moves if self.board.board.piece_at(move.to_square) is not None and self.board.board.piece_at(move.to_square).piece_type == tgt_piece]
-            if prm_piece is not None:
-                moves = [move for move in moves if move.promotion is not None and move.promotion == prm_piece]
+            # The four promotions of a pawn push count as one candidate, the promotion bubble picks among them
+            candidates = len({(move.from_square, move.to_square) for move in moves})
 
             # If a single move remains... that's it!
-            if len(moves) == 1 or (len(moves) == 4 and all(move.promotion is not None for move in moves)):
+            if candidates == 1:
                 # Special case if capture.
-                if verb != "capture" or self.board.board.piece_at(moves[0].to_square) is not None:
-                    return (moves[0].from_square, moves[0].to_square, prm_piece), some_command
+                if verb != "capture" or move_index.piece_type_at(moves[0].to_square) is not None:
+                    return (moves[0].from_square, moves[0].to_square, prm_piece), some_command, ambiguous
+            elif candidates > 1:
+                print(f"Ambiguous command, {candidates} moves match")
+                ambiguous += 1
 
-        return None, some_command
\ No newline at end of file
+        return None, some_command, ambiguous
\ No newline at end of file
@@ -0,0 +1,60 @@
+import pygame
+from collections import OrderedDict
+
+import config as cfg
+
+
+"""
+Fonts are opened once per (file, size) and shared by everyone rendering with them.
+"""
+FONTS = {}
+
+def get_font(path: str, size: int):
+    font = FONTS.get((path, size))
+    if font is None:
+        font = FONTS[(path, size)] = pygame.font.Font(path, size)
+    return font
+
+
+def color_key(color):
+    # Names, hex strings and tuples are used as they are, pygame.Color is not hashable
+    return tuple(color) if isinstance(color, pygame.Color) else color
+
+
+"""
+LRU cache of rendered strings, keyed by everything that changes their pixels.
+Text updated every frame (clocks, move lists, evaluations) only gets rasterized when it actually changes.
+The surfaces are shared between callers, they must not be drawn onto.
+"""
+class TextCache:
+    def __init__(self, size: int = cfg.TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, path: str, font_size: int, text: str, color, background=None, antialias: bool = cfg.TEXT_ANTIALIAS):
+        key = (path, font_size, text, color_key(color), color_key(background), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self.surfaces[key] = get_font(path, font_size).render(text, antialias, color, background)
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def stats(self):
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            cached = len(self.surfaces),
+        )
+
+TEXT_CACHE = TextCache()
+
+def render(path: str, font_size: int, text: str, color, background=None, antialias: bool = cfg.TEXT_ANTIALIAS):
+    return TEXT_CACHE.render(path, font_size, text, color, background, antialias)
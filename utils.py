@@ -56,17 +56,21 @@ def make_svg_restart(size=(140, 50), stroke_width=4):
     return text
 
 
-def plus_cursor_mask(size=19, bottom=7, top=11):
-    # Create an empty ndarray of size*size filled with zeros
-    plus_array = np.zeros((size, size), dtype=np.uint8)
-    
-    # Set the plus sign pattern in the array
-    plus_array[bottom:top+1, :] = 127
-    plus_array[:, bottom:top+1] = 127
-    
-    return plus_array
+def outlined_cursor_mask(size=19, bottom=7, top=11, outline=1):
+    # (core, ring) boolean masks of a plus with a ring of outline pixels around it, both fitting in size*size
+    core = np.zeros((size, size), dtype=bool)
+    core[bottom:top+1, outline:size-outline] = True
+    core[outline:size-outline, bottom:top+1] = True
+
+    ring = core.copy()
+    for dx in range(-outline, outline + 1):
+        for dy in range(-outline, outline + 1):
+            ring |= np.roll(np.roll(core, dx, axis=0), dy, axis=1)
+    return core, ring & ~core
 
 
 TURN_DONE = pygame.USEREVENT + 1
 GAME_ENDED = pygame.USEREVENT + 2
-ELAPSED_AI_MOVING_TIME = pygame.USEREVENT + 3
\ No newline at end of file
+ELAPSED_AI_MOVING_TIME = pygame.USEREVENT + 3
+WAKE_UP = pygame.USEREVENT + 4
+ENGINE_MOVE = pygame.USEREVENT + 5
\ No newline at end of file